@@ -3,6 +3,7 @@ import requests
 import pandas as pd
 from dotenv import load_dotenv
 import os
+import time
 
 load_dotenv()
 
@@ -56,9 +57,23 @@ with tab3:
     st.header("Order Allocation")
     if st.button("Trigger Order Allocation"):
         with st.spinner("Allocating orders..."):
-            response = requests.post(f"{BASE_URL}/allocate-all-orders")
-            if response.status_code == 200:
-                st.success(response.json().get("message", "Orders successfully allocated!"))
+            response = requests.post(f"{BASE_URL}/allocate-all-orders", params={"parallel": "true", "async": "true"})
+            if response.status_code == 202:
+                job_id = response.json()["job_id"]
+                progress_text = st.empty()
+
+                # Poll the allocation job until it finishes
+                while True:
+                    job = requests.get(f"{BASE_URL}/allocation-jobs/{job_id}").json()
+                    progress_text.write(f"Job {job_id} {job['status']}: {len(job['progress'])} progress updates")
+                    if job["status"] in ("completed", "failed"):
+                        break
+                    time.sleep(2)
+
+                if job["status"] == "completed":
+                    st.success(f"Orders successfully allocated! {job['result']['orders_allocated']} orders allocated.")
+                else:
+                    st.error(f"Order allocation failed: {job['error']}")
             else:
                 st.error(f"Failed to trigger order allocation: {response.text}")
 
@@ -192,6 +207,7 @@ with tab10:
     x_coord = st.number_input("X Coord")
     y_coord = st.number_input("Y Coord")
     warehouse_id = st.text_input("Enter Warehouse ID")
+    allocate = st.checkbox("Assign to a checked-in agent right away")
 
     # Button to trigger the order upload
     if st.button("Upload Single Order"):
@@ -204,7 +220,11 @@ with tab10:
                     "y_coord": y_coord
                 }
                 with st.spinner("Uploading single order..."):
-                    response = requests.post(f"{BASE_URL}/upload-single-order/", json=order_data)
+                    response = requests.post(
+                        f"{BASE_URL}/upload-single-order/",
+                        params={"allocate": str(allocate).lower()},
+                        json=order_data
+                    )
                     if response.status_code == 200:
                         st.success(response.json().get("message", "Order uploaded successfully!"))
                     else:
@@ -1,70 +1,151 @@
-from database.models import AgentsBigPic,OrdersBigPic
-from sqlalchemy import delete
+from database.models import AgentsBigPic,Warehouse
+from database.order_history import archive_delivered_orders
+from database.data_version import bump_data_version
+from sqlalchemy import select, case, update, func
 import random
 from sqlalchemy.orm import Session
 
-def mark_agent_check_in(session: Session):
-    agents = session.query(AgentsBigPic).all()
+CHECK_IN_CHUNK_SIZE = 5000
 
-    if not agents:
-        return None
+def check_in_agents(session: Session, agent_ids):
+    """
+    Mark the given agents as checked in with one UPDATE ... WHERE id IN per chunk of IDs.
 
-    
-    attnd_percentage = random.randint(60,90)
-    no_of_present_agents = int((attnd_percentage/100) * len(agents))
+    Parameters:
+    session (Session): SQLAlchemy session.
+    agent_ids (list): IDs of the agents to check in, unknown IDs are ignored.
 
-    selected_agents = random.sample(agents, no_of_present_agents)
+    Returns:
+    int: Number of agents marked as checked in.
+    """
+    agent_ids = list(dict.fromkeys(int(agent_id) for agent_id in agent_ids))
+    checked_in = 0
+    for start in range(0, len(agent_ids), CHECK_IN_CHUNK_SIZE):
+        chunk = agent_ids[start:start + CHECK_IN_CHUNK_SIZE]
+        checked_in += session.execute(
+            update(AgentsBigPic).where(AgentsBigPic.id.in_(chunk)).values(is_checked_in=True)
+        ).rowcount
 
-    for agent in selected_agents:
-        agent.is_checked_in = True 
-    
+    bump_data_version(session)
     session.commit()
 
-    return len(selected_agents)
+    return checked_in
 
-def mark_Warehouse_agent_check_in(session: Session,warehouse_id,percent):
-    agents = session.query(AgentsBigPic).filter(AgentsBigPic.warehouse_id == warehouse_id).all()
+def sample_agent_ids(session: Session, percent, warehouse_id=None):
+    """
+    Pick a random share of the agents, reading their IDs only.
 
-    if not agents:
-        return None
+    Parameters:
+    session (Session): SQLAlchemy session.
+    percent (int): Share of the agents to pick, in percent.
+    warehouse_id (int, optional): Only pick agents of this warehouse.
 
-    
-    percent = int(percent)
-    no_of_present_agents = int((percent/100) * len(agents))
+    Returns:
+    list: Sampled agent IDs, None if there are no agents.
+    """
+    query = session.query(AgentsBigPic.id)
+    if warehouse_id is not None:
+        query = query.filter(AgentsBigPic.warehouse_id == warehouse_id)
+    agent_ids = [agent_id for agent_id, in query]
 
-    selected_agents = random.sample(agents, no_of_present_agents)
+    if not agent_ids:
+        return None
 
-    for agent in selected_agents:
-        agent.is_checked_in = True 
-    
-    session.commit()
+    no_of_present_agents = int((percent/100) * len(agent_ids))
+    return random.sample(agent_ids, no_of_present_agents)
 
-    return len(selected_agents)
+def mark_agent_check_in(session: Session):
+    attnd_percentage = random.randint(60,90)
+    selected_agents = sample_agent_ids(session, attnd_percentage)
 
-def mark_all_checked_out(session: Session):
-    session.query(AgentsBigPic).update({AgentsBigPic.is_checked_in: False})
-    session.commit()
+    if selected_agents is None:
+        return None
 
-    #pop all orders that were delivered
-    session.execute(
-        delete(OrdersBigPic).where(OrdersBigPic.is_delivered == True)
-    )
-    session.commit()
+    return check_in_agents(session, selected_agents)
 
-    session.query(AgentsBigPic).update({AgentsBigPic.orders: [],AgentsBigPic.no_of_orders:0,AgentsBigPic.total_distance:0})
+def mark_Warehouse_agent_check_in(session: Session,warehouse_id,percent):
+    selected_agents = sample_agent_ids(session, int(percent), warehouse_id)
 
-    session.commit()
+    if selected_agents is None:
+        return None
 
-    return 1
+    return check_in_agents(session, selected_agents)
 
-def calculate_earnings(session,agent_id):
-    agent = session.query(AgentsBigPic).filter(AgentsBigPic.id == agent_id).first()
-    total_earnings = 0
-    if agent.is_checked_in:
-        total_earnings = 500
-        if agent.no_of_orders > 50:
-            total_earnings = 42 * agent.no_of_orders
-        elif agent.no_of_orders > 25:
-            total_earnings = 35 * agent.no_of_orders
+def mark_all_checked_out(session: Session):
+    """
+    End the day in a single transaction: check every agent out, move the delivered orders
+    to the delivered orders history, clear the routes and send the agents back to their warehouse.
+
+    Parameters:
+    session (Session): SQLAlchemy session.
+
+    Returns:
+    int: 1 if successful, 0 otherwise.
+    """
+    try:
+        # Agents start the next day back at their warehouse
+        warehouse = select(Warehouse).where(Warehouse.id == AgentsBigPic.warehouse_id)
+        session.query(AgentsBigPic).update({
+            AgentsBigPic.is_checked_in: False,
+            AgentsBigPic.no_of_orders:0,
+            AgentsBigPic.total_distance:0,
+            AgentsBigPic.last_x: warehouse.with_only_columns(Warehouse.x_coord).scalar_subquery(),
+            AgentsBigPic.last_y: warehouse.with_only_columns(Warehouse.y_coord).scalar_subquery(),
+            AgentsBigPic.route_version: func.coalesce(AgentsBigPic.route_version, 0) + 1,
+        }, synchronize_session=False)
+
+        # Only delivered orders leave the orders table, so the undelivered counters stay valid
+        archived = archive_delivered_orders(session)
+
+        bump_data_version(session)
+        session.commit()
+        print(f"Archived {archived} delivered orders")
+        return 1
+    except Exception as e:
+        session.rollback()
+        print(f"Error checking agents out: {e}")
+        return 0
+
+def earnings_expression():
+    """
+    SQL expression for an agent's earnings: nothing when not checked in, 42 per order above
+    50 orders, 35 per order above 25 orders and 500 otherwise.
+    """
+    return case(
+        (AgentsBigPic.is_checked_in == False, 0),
+        (AgentsBigPic.no_of_orders > 50, 42 * AgentsBigPic.no_of_orders),
+        (AgentsBigPic.no_of_orders > 25, 35 * AgentsBigPic.no_of_orders),
+        else_=500,
+    )
 
-    return total_earnings
+def agents_day_summary_rows(session, warehouse_id=None, batch_size=500):
+    """
+    Lazily read every agent's day info with a single query, fetched in batches through a
+    server-side cursor where the driver supports one.
+
+    Parameters:
+    session (Session): SQLAlchemy session.
+    warehouse_id (int, optional): Only include the agents of this warehouse.
+    batch_size (int): Rows fetched per round trip.
+
+    Yields:
+    dict: Agent ID, number of orders, distance, earnings and check-in state.
+    """
+    query = session.query(
+        AgentsBigPic.id,
+        AgentsBigPic.no_of_orders,
+        AgentsBigPic.total_distance,
+        AgentsBigPic.is_checked_in,
+        earnings_expression().label("total_earnings"),
+    )
+    if warehouse_id is not None:
+        query = query.filter(AgentsBigPic.warehouse_id == warehouse_id)
+
+    for agent in query.order_by(AgentsBigPic.id).yield_per(batch_size):
+        yield {
+            "id": agent.id,
+            "no_of_orders": agent.no_of_orders,
+            "total_distance": agent.total_distance,
+            "total_earnings": agent.total_earnings,
+            "is_checked_in": agent.is_checked_in,
+        }
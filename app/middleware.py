@@ -0,0 +1,50 @@
+import time
+import falcon
+from monitoring.metrics import HTTP_REQUEST_DURATION
+
+class MetricsMiddleware:
+    """
+    Falcon middleware timing every request by its route template.
+    """
+    def process_request(self, req, resp):
+        req.context.metrics_start = time.perf_counter()
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        start = getattr(req.context, "metrics_start", None)
+        if start is None:
+            return
+        HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - start,
+            method=req.method,
+            route=req.uri_template or "unmatched",
+            status=falcon.http_status_to_code(resp.status),
+        )
+
+class SessionMiddleware:
+    def __init__(self, session_factory):
+        """
+        Falcon middleware giving every routed request its own database session in req.context.db.
+
+        The session is committed when the request succeeds, rolled back when it fails, and
+        closed either way, so its connection always goes back to the pool.
+
+        Args:
+            session_factory (sessionmaker): Factory creating the sessions.
+        """
+        self.session_factory = session_factory
+
+    def process_resource(self, req, resp, resource, params):
+        if resource is not None:
+            req.context.db = self.session_factory()
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        db = getattr(req.context, "db", None)
+        if db is None:
+            return
+        try:
+            if req_succeeded:
+                db.commit()
+            else:
+                db.rollback()
+        finally:
+            db.close()
@@ -1,7 +1,10 @@
+import json
 import falcon
 from database.db import get_db
-from database.models import Warehouse,AgentsBigPic
-from agent_functions.AgentFunctions import mark_agent_check_in,mark_all_checked_out,mark_Warehouse_agent_check_in,calculate_earnings
+from database.data_version import current_data_version
+from agent_functions.AgentFunctions import check_in_agents,mark_agent_check_in,mark_all_checked_out,mark_Warehouse_agent_check_in,agents_day_summary_rows
+from app.response_cache import serve_cached, caching_stream
+from app.streaming import not_modified, json_array_chunks, stream_json
 
 class AutoAgentCheckIn:
     def __init__(self, get_db):
@@ -16,15 +19,15 @@ class AutoAgentCheckIn:
     def on_post(self, req, resp):
         """Randomly mark agents as signed in!"""
 
-        # Get a database session
-        with self.get_db() as db:
-            
-            # Call the function to randomly mark 80% of agents as signed in
-            no_present = mark_agent_check_in(db)
+        # Request-scoped session opened by SessionMiddleware
+        db = req.context.db
 
-            # Respond with the number of agents marked as signed in
-            resp.status = falcon.HTTP_200
-            resp.media = {"message": f"{no_present} agents have been randomly marked as checked in."}
+        # Call the function to randomly mark 80% of agents as signed in
+        no_present = mark_agent_check_in(db)
+
+        # Respond with the number of agents marked as signed in
+        resp.status = falcon.HTTP_200
+        resp.media = {"message": f"{no_present} agents have been randomly marked as checked in."}
 
 class WarehouseAgentCheckIn:
     def __init__(self, get_db):
@@ -39,15 +42,46 @@ class WarehouseAgentCheckIn:
     def on_post(self, req, resp,warehouse_id,percent):
         """Randomly mark agents as signed in!"""
 
-        # Get a database session
-        with self.get_db() as db:
-            
-            no_present = mark_Warehouse_agent_check_in(db,warehouse_id,percent)
+        # Request-scoped session opened by SessionMiddleware
+        db = req.context.db
 
-            # Respond with the number of agents marked as signed in
-            resp.status = falcon.HTTP_200
-            resp.media = {"message": f"{no_present} agents have been randomly marked as checked in."}
+        no_present = mark_Warehouse_agent_check_in(db,warehouse_id,percent)
+
+        # Respond with the number of agents marked as signed in
+        resp.status = falcon.HTTP_200
+        resp.media = {"message": f"{no_present} agents have been randomly marked as checked in."}
+
+
+class AgentsCheckIn:
+    def __init__(self, get_db):
+        """
+        Initialize the resource with a database session provider.
+
+        Args:
+            get_db (function): Function to provide a database session.
+        """
+        self.get_db = get_db
 
+    def on_post(self, req, resp):
+        """
+        Mark the agents reported by a check-in feed as signed in.
+
+        Body:
+            {"agent_ids": [1, 2, ...]}
+        """
+        media = req.get_media(default_when_empty=None)
+        agent_ids = media.get("agent_ids") if isinstance(media, dict) else None
+        # bool is a subclass of int, so true / false would otherwise pass as agents 1 and 0
+        if not isinstance(agent_ids, list) or not all(type(agent_id) is int for agent_id in agent_ids):
+            raise falcon.HTTPBadRequest(title="Invalid body", description="agent_ids must be a list of agent IDs")
+
+        # Request-scoped session opened by SessionMiddleware
+        db = req.context.db
+
+        no_present = check_in_agents(db, agent_ids)
+
+        resp.status = falcon.HTTP_200
+        resp.media = {"message": f"{no_present} agents have been marked as checked in.", "checked_in": no_present}
 
 class AgentCheckOut:
     def __init__(self, get_db):
@@ -62,15 +96,16 @@ class AgentCheckOut:
     def on_post(self, req, resp):
         """Randomly mark agents as signed in!"""
 
-        # Get a database session
-        with self.get_db() as db:
-
-            # Call the function to randomly mark 80% of agents as signed in
-            mark_all_checked_out(db)
+        # Request-scoped session opened by SessionMiddleware
+        db = req.context.db
 
-            # Respond with the number of agents marked as signed in
+        # Check everyone out and archive the delivered orders in one transaction
+        if mark_all_checked_out(db) == 1:
             resp.status = falcon.HTTP_200
             resp.media = {"message": f"agents have been marked checked out."}
+        else:
+            resp.status = falcon.HTTP_500
+            resp.media = {"message": "Failed to check agents out."}
 
 class AgentsDaySummary:
     def __init__(self, get_db):
@@ -83,31 +118,36 @@ class AgentsDaySummary:
         self.get_db = get_db
 
     def on_get(self, req, resp):
-        """get agents info for the day"""
-
-        # Get a database session
-        with self.get_db() as db:
-
-            agents = db.query(AgentsBigPic).order_by(AgentsBigPic.id).all()
-
-            total_orders = 0
-            total_expense = 0
-            agents_info = []
-            for agent in agents:
-                earnings = calculate_earnings(db,agent.id)
-                total_expense+=earnings
-                total_orders+= agent.no_of_orders
-                agents_info.append({
-                    "id": agent.id,
-                    "no_of_orders": agent.no_of_orders,
-                    "total_distance": agent.total_distance,
-                    "total_earnings": earnings,
-                    "is_checked_in": agent.is_checked_in,
-                })
-            if total_orders>0:
-                cost_per_order = total_expense/total_orders
-            else:
-                cost_per_order = 0
+        """
+        Get agents info for the day, streamed as the rows are fetched.
 
-            resp.status = falcon.HTTP_200
-            resp.media = {"agents": agents_info,"total_no_of_orders": total_orders,"cost_per_order":cost_per_order}
\ No newline at end of file
+        Query Params:
+            warehouse_id (int): Only summarise the agents of this warehouse.
+        """
+        warehouse_id = req.get_param_as_int("warehouse_id")
+
+        # Request-scoped session opened by SessionMiddleware
+        db = req.context.db
+
+        # Clients holding the current version get a 304, and the others a cached body if there is one
+        version = current_data_version(db)
+        if not_modified(req, resp, version) or serve_cached(req, resp, version):
+            return
+
+        def produce(session):
+            totals = {"orders": 0, "expense": 0}
+
+            def agents():
+                for agent in agents_day_summary_rows(session, warehouse_id):
+                    totals["orders"] += agent["no_of_orders"]
+                    totals["expense"] += agent["total_earnings"]
+                    yield agent
+
+            yield '{"agents": ['
+            yield from json_array_chunks(agents())
+            cost_per_order = totals["expense"] / totals["orders"] if totals["orders"] > 0 else 0
+            yield f'], "total_no_of_orders": {json.dumps(totals["orders"])}, "cost_per_order": {json.dumps(cost_per_order)}}}'
+
+        resp.status = falcon.HTTP_200
+        resp.content_type = falcon.MEDIA_JSON
+        resp.stream = caching_stream(req, version, stream_json(self.get_db, produce))
@@ -1,7 +1,8 @@
 import falcon
+from database.db import pool_status
 
 class HealthCheckResource:
     def on_get(self, req, resp):
-        """Health check endpoint."""
-        resp.media = {"status": "ok"}
+        """Health check endpoint, with the database connection pool usage."""
+        resp.media = {"status": "ok", "db_pool": pool_status()}
         resp.status = falcon.HTTP_200
@@ -0,0 +1,11 @@
+import falcon
+from database.db import pool_status
+from monitoring.metrics import REGISTRY, observe_pool
+
+class MetricsResource:
+    def on_get(self, req, resp):
+        """Metrics in the Prometheus text exposition format."""
+        observe_pool(pool_status())
+        resp.content_type = "text/plain; version=0.0.4; charset=utf-8"
+        resp.text = REGISTRY.render()
+        resp.status = falcon.HTTP_200
@@ -1,8 +1,12 @@
 import falcon
 from database.db import get_db
-from database.models import OrdersBigPic,Warehouse,AgentsBigPic
-from sqlalchemy import and_
-from orders_upload.upload_orders import generate_random_orders,upload_warehouse_orders
+from database.models import OrdersBigPic,AgentsBigPic,RouteStop
+from database.data_version import current_data_version
+from database.order_counters import USE_ORDER_COUNTERS, count_undelivered_orders, read_order_counters
+from app.response_cache import serve_cached, caching_stream
+from app.streaming import STREAM_BATCH_SIZE, not_modified, json_array_chunks, stream_json
+from warehouse_order_allocation.online_insertion import insert_order_into_route
+from orders_upload.upload_orders import generate_random_orders,upload_warehouse_orders,upload_orders_batch,iter_ndjson_rows,iter_json_array_rows,ORDER_DISTRIBUTIONS
 
 class UploadRandomOrders:
     def __init__(self, get_db):
@@ -15,16 +19,33 @@ class UploadRandomOrders:
         self.get_db = get_db
 
     def on_post(self,req,resp):
-        with self.get_db() as db:
+        """
+        Generate random orders for every warehouse.
+
+        Query Params:
+            count (int): Orders per warehouse. Defaults to a random count between 600 and 1200.
+            distribution (str): "uniform" or "normal" placement around the warehouse. Defaults to uniform.
+            seed (int): Seed for a reproducible order set.
+        """
+        no_of_orders = req.get_param_as_int("count", min_value=1)
+        distribution = req.get_param("distribution", default="uniform")
+        seed = req.get_param_as_int("seed")
+        if distribution not in ORDER_DISTRIBUTIONS:
+            raise falcon.HTTPBadRequest(
+                title="Invalid distribution",
+                description=f"distribution must be one of {', '.join(ORDER_DISTRIBUTIONS)}"
+            )
 
-            result = generate_random_orders(db)
+        db = req.context.db
 
-            if result == 1:  # If orders were successfully generated
-                resp.status = falcon.HTTP_200
-                resp.media = {"message": "Orders successfully generated and uploaded."}
-            else:  # If there was an error during order generation
-                resp.status = falcon.HTTP_500
-                resp.media = {"message": "Failed to generate orders due to an error."}
+        result = generate_random_orders(db, no_of_orders, distribution, seed)
+
+        if result == 1:  # If orders were successfully generated
+            resp.status = falcon.HTTP_200
+            resp.media = {"message": "Orders successfully generated and uploaded."}
+        else:  # If there was an error during order generation
+            resp.status = falcon.HTTP_500
+            resp.media = {"message": "Failed to generate orders due to an error."}
 
 class UploadWarehouseOrders:
     def __init__(self, get_db):
@@ -37,19 +58,32 @@ class UploadWarehouseOrders:
         self.get_db = get_db
 
     def on_post(self,req,resp):
-        order_dict = req.media
-        with self.get_db() as db:
+        """
+        Upload a single order.
 
-            result = upload_warehouse_orders(db,order_dict)
+        Query Params:
+            allocate (bool): Insert the order straight into the cheapest feasible position of a
+                checked-in agent's route instead of leaving it for the next allocation run.
+        """
+        order_dict = req.media
+        allocate = req.get_param_as_bool("allocate", default=False)
+        db = req.context.db
 
-            if result == 1:  # If orders were successfully generated
-                resp.status = falcon.HTTP_200
-                resp.media = {"message": "Order successfully uploaded."}
-            else:  # If there was an error during order generation
-                resp.status = falcon.HTTP_500
-                resp.media = {"message": "Failed to generate orders due to an error."}
+        result = upload_warehouse_orders(db,order_dict)
 
-class OrdersLeft:
+        if result:  # If orders were successfully generated
+            resp.status = falcon.HTTP_200
+            resp.media = {"message": "Order successfully uploaded.", "order_id": result}
+            if allocate:
+                agent_id = insert_order_into_route(db, result)
+                resp.media["assigned_agent_id"] = agent_id
+                if agent_id is None:
+                    resp.media["message"] = "Order successfully uploaded, no agent can take it yet."
+        else:  # If there was an error during order generation
+            resp.status = falcon.HTTP_500
+            resp.media = {"message": "Failed to generate orders due to an error."}
+
+class UploadWarehouseOrdersBatch:
     def __init__(self, get_db):
         """
         Initialize the resource with a database session provider.
@@ -59,25 +93,29 @@ class OrdersLeft:
         """
         self.get_db = get_db
 
-    def on_get(self,req,resp,):
-        with self.get_db() as db:
+    def on_post(self, req, resp):
+        """
+        Upload many orders from a streamed NDJSON or JSON array body.
 
-            warehouses_ids = [warehouse.id for warehouse in db.query(Warehouse).all()]
+        Query Params:
+            chunk_size (int): Number of orders inserted per bulk statement. Defaults to 1000.
+        """
+        chunk_size = req.get_param_as_int("chunk_size", min_value=1, default=1000)
+        if req.content_type and "ndjson" in req.content_type:
+            rows = iter_ndjson_rows(req.bounded_stream)
+        else:
+            rows = iter_json_array_rows(req.bounded_stream)
 
-            orders_info = []
-            for warehouse_id in warehouses_ids:
-                orders = db.query(OrdersBigPic).filter(and_(OrdersBigPic.is_delivered==False,OrdersBigPic.warehouse_id==warehouse_id)).all()
-                no_of_orders = len(orders)
-                orders_info.append({
-                        "warehouse_id": warehouse_id,
-                        "no_of_orders": no_of_orders
-                    })
-        
+        db = req.context.db
+        try:
+            result = upload_orders_batch(db, rows, chunk_size)
+        except ValueError as e:
+            raise falcon.HTTPBadRequest(title="Invalid body", description=str(e))
 
-            resp.status = falcon.HTTP_200
-            resp.media = {"orders": orders_info}
+        resp.status = falcon.HTTP_200
+        resp.media = {"message": f"{result['inserted']} orders uploaded, {result['failed']} rejected.", **result}
 
-class AgentOrders:
+class OrdersLeft:
     def __init__(self, get_db):
         """
         Initialize the resource with a database session provider.
@@ -87,37 +125,113 @@ class AgentOrders:
         """
         self.get_db = get_db
 
-    def on_get(self, req, resp, agent_id):
-        """Get agent's info for the day"""
-
-        # Get a database session
-        with self.get_db() as db:
+    def on_get(self,req,resp,):
+        db = req.context.db
+
+        # Clients holding the current version get a 304, and the others a cached body if there is one
+        version = current_data_version(db)
+        if not_modified(req, resp, version) or serve_cached(req, resp, version):
+            return
+
+        def produce(session):
+            # The maintained counters avoid touching the orders table at all
+            if USE_ORDER_COUNTERS:
+                counts = read_order_counters(session)
+            else:
+                counts = count_undelivered_orders(session)
+
+            yield '{"orders": ['
+            yield from json_array_chunks(
+                {"warehouse_id": warehouse_id, "no_of_orders": no_of_orders}
+                for warehouse_id, no_of_orders in counts
+            )
+            yield ']}'
+
+        resp.status = falcon.HTTP_200
+        resp.content_type = falcon.MEDIA_JSON
+        resp.stream = caching_stream(req, version, stream_json(self.get_db, produce))
 
-            # Fetch all orders assigned to the agent
-            orders = db.query(OrdersBigPic).filter(OrdersBigPic.assigned_agent_id == agent_id).all()
+class AgentOrders:
+    def __init__(self, get_db):
+        """
+        Initialize the resource with a database session provider.
 
-            # Create a dictionary for quick lookup by order ID
-            orders_info_dict = {
-                order.id: {
-                    "id": order.id,
-                    "x_coord": order.x_coord,
-                    "y_coord": order.y_coord,
-                }
-                for order in orders
-            }
+        Args:
+            get_db (function): Function to provide a database session.
+        """
+        self.get_db = get_db
 
-            # Fetch agent information
-            agent_info = db.query(AgentsBigPic).filter(AgentsBigPic.id == agent_id).first()
-            if not agent_info:
-                raise falcon.HTTPNotFound(description=f"Agent with ID {agent_id} not found")
+    def on_get(self, req, resp, agent_id):
+        """Get agent's info for the day, streamed in stop order as the rows are fetched"""
+
+        # Request-scoped session opened by SessionMiddleware
+        db = req.context.db
+
+        # Clients holding the current version get a 304, and the others a cached body if there is one
+        version = current_data_version(db)
+        if not_modified(req, resp, version) or serve_cached(req, resp, version):
+            return
+
+        # The status has to be known before streaming starts
+        if not db.query(AgentsBigPic.id).filter(AgentsBigPic.id == agent_id).first():
+            raise falcon.HTTPNotFound(description=f"Agent with ID {agent_id} not found")
+
+        def produce(session):
+            # Read the agent's route in stop order
+            route = session.query(OrdersBigPic.id, OrdersBigPic.x_coord, OrdersBigPic.y_coord).join(
+                RouteStop, RouteStop.order_id == OrdersBigPic.id
+            ).filter(RouteStop.agent_id == agent_id).order_by(RouteStop.seq).yield_per(STREAM_BATCH_SIZE)
+
+            yield '{"orders": ['
+            yield from json_array_chunks(
+                {"id": order_id, "x_coord": x_coord, "y_coord": y_coord}
+                for order_id, x_coord, y_coord in route
+            )
+            yield ']}'
+
+        resp.status = falcon.HTTP_200
+        resp.content_type = falcon.MEDIA_JSON
+        resp.stream = caching_stream(req, version, stream_json(self.get_db, produce))
+
+class AllAgentsOrders:
+    def __init__(self, get_db):
+        """
+        Initialize the resource with a database session provider.
 
-            # Ensure order_route is not None
-            order_route = agent_info.orders or []
+        Args:
+            get_db (function): Function to provide a database session.
+        """
+        self.get_db = get_db
 
-            # Create the response list in the order of order_route
-            ordered_orders_info = [
-                orders_info_dict[order_id] for order_id in order_route if order_id in orders_info_dict
-            ]
+    def on_get(self, req, resp):
+        """
+        Get every agent's route for the day in one response.
 
-            resp.status = falcon.HTTP_200
-            resp.media = {"orders": ordered_orders_info}
\ No newline at end of file
+        Query Params:
+            warehouse_id (int): Only return the routes of this warehouse's agents.
+        """
+        warehouse_id = req.get_param_as_int("warehouse_id")
+
+        # Request-scoped session opened by SessionMiddleware
+        db = req.context.db
+
+        # One ordered pass over all routes; agents without stops still get an entry
+        query = db.query(
+            AgentsBigPic.id, OrdersBigPic.id, OrdersBigPic.x_coord, OrdersBigPic.y_coord
+        ).outerjoin(
+            RouteStop, RouteStop.agent_id == AgentsBigPic.id
+        ).outerjoin(
+            OrdersBigPic, OrdersBigPic.id == RouteStop.order_id
+        )
+        if warehouse_id is not None:
+            query = query.filter(AgentsBigPic.warehouse_id == warehouse_id)
+
+        routes = []
+        for agent_id, order_id, x_coord, y_coord in query.order_by(AgentsBigPic.id, RouteStop.seq):
+            if not routes or routes[-1]["agent_id"] != agent_id:
+                routes.append({"agent_id": agent_id, "orders": []})
+            if order_id is not None:
+                routes[-1]["orders"].append({"id": order_id, "x_coord": x_coord, "y_coord": y_coord})
+
+        resp.status = falcon.HTTP_200
+        resp.media = {"routes": routes}
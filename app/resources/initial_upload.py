@@ -1,12 +1,20 @@
 import json
 import falcon
 from sqlalchemy.orm import Session
-from database.db import get_db
 from database.models import Warehouse, AgentsBigPic
+from database.order_counters import refresh_order_counters
+from database.data_version import bump_data_version
 import os
 
 class LoadDataResource:
-    def __init__(self):
+    def __init__(self, get_db):
+        """
+        Initialize the resource with a database session provider.
+
+        Args:
+            get_db (function): Function to provide a database session.
+        """
+        self.get_db = get_db
         # Hardcoded file paths
         base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'))  # Go up to the project root
         self.warehouse_file_path = os.path.join(base_dir, "data", "wareHouse_info.json")
@@ -32,13 +40,16 @@ class LoadDataResource:
 
         # Insert data into the database
         try:
-            with get_db() as session:
-                # Add warehouses
-                for warehouse in warehouse_data:
-                    warehouse_ob = Warehouse(**warehouse)
-                    session.add(warehouse_ob)
-                session.commit()
-                print("Warehouses added successfully!")
+            session = req.context.db
+            # Add warehouses
+            for warehouse in warehouse_data:
+                warehouse_ob = Warehouse(**warehouse)
+                session.add(warehouse_ob)
+            session.flush()
+            refresh_order_counters(session)
+            bump_data_version(session)
+            session.commit()
+            print("Warehouses added successfully!")
 
         except Exception as e:
             raise falcon.HTTPInternalServerError(
@@ -47,13 +58,14 @@ class LoadDataResource:
             )
 
         try:
-            with get_db() as session:
-                # Add agents
-                for agent in agent_data:
-                    agent_ob = AgentsBigPic(**agent)
-                    session.add(agent_ob)
-                session.commit()
-                print("Agents added successfully!")
+            session = req.context.db
+            # Add agents
+            for agent in agent_data:
+                agent_ob = AgentsBigPic(**agent)
+                session.add(agent_ob)
+            bump_data_version(session)
+            session.commit()
+            print("Agents added successfully!")
 
         except Exception as e:
             raise falcon.HTTPInternalServerError(
@@ -1,7 +1,11 @@
+import time
 import falcon
 from database.db import get_db
 from database.models import Warehouse
+from monitoring.metrics import observe_allocation
 from warehouse_order_allocation.Order_allocator import OrderAllocator
+from warehouse_order_allocation.parallel_allocation import ALLOCATION_WORKERS, allocate_warehouse, allocate_warehouses_parallel
+from warehouse_order_allocation.allocation_jobs import submit_allocation_job, get_allocation_job
 
 class AllocateOrdersResource:
     def __init__(self, get_db):
@@ -20,23 +24,41 @@ class AllocateOrdersResource:
         Args:
             warehouse_id (int): ID of the warehouse to allocate orders for.
 
+        Query Params:
+            async (bool): Queue the allocation as a background job and return its ID. Defaults to false.
+
         Returns:
             JSON: Success message with details about the allocation process.
         """
-        # Get a database session
-        with self.get_db() as db:
-            # Fetch the warehouse by ID
-            warehouse = db.query(Warehouse).filter(Warehouse.id == warehouse_id).first()
-
-            if not warehouse:
-                raise falcon.HTTPNotFound(description=f"Warehouse with ID {warehouse_id} not found")
-
-            # Perform order allocation
-            order_allocator = OrderAllocator(db, warehouse)
-            order_allocator.allocate_orders()
-
-            resp.media = {"message": f"Order allocation completed for warehouse ID {warehouse_id}"}
-            resp.status = falcon.HTTP_200
+        # Request-scoped session opened by SessionMiddleware
+        db = req.context.db
+        # Fetch the warehouse by ID
+        warehouse = db.query(Warehouse).filter(Warehouse.id == warehouse_id).first()
+
+        if not warehouse:
+            raise falcon.HTTPNotFound(description=f"Warehouse with ID {warehouse_id} not found")
+
+        if req.get_param_as_bool("async", default=False):
+            job_id = submit_allocation_job(self.get_db, warehouse_id=warehouse.id)
+            resp.media = {"message": f"Order allocation queued for warehouse ID {warehouse_id}", "job_id": job_id}
+            resp.status = falcon.HTTP_202
+            return
+
+        # Perform order allocation
+        start = time.perf_counter()
+        order_allocator = OrderAllocator(db, warehouse)
+        orders_allocated = order_allocator.allocate_orders()
+        observe_allocation({
+            "warehouse_id": warehouse.id,
+            "status": "completed",
+            "orders_allocated": orders_allocated,
+            "iterations": order_allocator.iterations,
+            "phase_seconds": order_allocator.phase_seconds,
+            "elapsed_seconds": time.perf_counter() - start,
+        })
+
+        resp.media = {"message": f"Order allocation completed for warehouse ID {warehouse_id}"}
+        resp.status = falcon.HTTP_200
 
 
 class AllocateAllOrdersResource:
@@ -53,21 +75,74 @@ class AllocateAllOrdersResource:
         """
         Endpoint to allocate orders for all warehouses.
 
+        Query Params:
+            parallel (bool): Allocate warehouses concurrently in a process pool. Defaults to false.
+            workers (int): Size of the process pool in parallel mode. Defaults to ALLOCATION_WORKERS.
+            async (bool): Queue the allocation as a background job and return its ID. Defaults to false.
+
         Returns:
-            JSON: Success message with details about the allocation process for all warehouses.
+            JSON: Success message with a per-warehouse summary of the allocation process.
         """
-        # Get a database session
-        with self.get_db() as db:
-            # Fetch all warehouses
-            warehouses = db.query(Warehouse).all()
+        parallel = req.get_param_as_bool("parallel", default=False)
+        workers = req.get_param_as_int("workers", min_value=1, default=ALLOCATION_WORKERS)
+
+        # Request-scoped session opened by SessionMiddleware
+        db = req.context.db
+        # Fetch all warehouses
+        warehouse_ids = [warehouse_id for (warehouse_id,) in db.query(Warehouse.id).order_by(Warehouse.id)]
+        # Each warehouse is allocated on a session of its own, hand the connection back meanwhile
+        db.commit()
+
+        if not warehouse_ids:
+            raise falcon.HTTPNotFound(description="No warehouses found")
+
+        if req.get_param_as_bool("async", default=False):
+            job_id = submit_allocation_job(self.get_db, parallel=parallel, workers=workers)
+            resp.media = {"message": "Order allocation queued for all warehouses", "job_id": job_id}
+            resp.status = falcon.HTTP_202
+            return
+
+        start = time.perf_counter()
+
+        # Perform order allocation for each warehouse
+        if parallel:
+            warehouses_info = allocate_warehouses_parallel(warehouse_ids, workers)
+        else:
+            warehouses_info = [allocate_warehouse(warehouse_id, self.get_db) for warehouse_id in warehouse_ids]
+
+        resp.media = {
+            "message": "Order allocation completed for all warehouses",
+            "warehouses": warehouses_info,
+            "elapsed_seconds": round(time.perf_counter() - start, 3),
+        }
+        resp.status = falcon.HTTP_200
+
+
+class AllocationJobResource:
+    def __init__(self, get_db):
+        """
+        Initialize the resource with a database session provider.
 
-            if not warehouses:
-                raise falcon.HTTPNotFound(description="No warehouses found")
+        Args:
+            get_db (function): Function to provide a database session.
+        """
+        self.get_db = get_db
+
+    def on_get(self, req, resp, job_id):
+        """
+        Endpoint to poll the state of an allocation job.
+
+        Args:
+            job_id (int): ID of the job returned when the allocation was queued.
+
+        Returns:
+            JSON: Job status, per-iteration progress and, once finished, the final stats.
+        """
+        db = req.context.db
+        job = get_allocation_job(db, job_id)
 
-            # Perform order allocation for each warehouse
-            for warehouse in warehouses:
-                order_allocator = OrderAllocator(db, warehouse)
-                order_allocator.allocate_orders()
+        if not job:
+            raise falcon.HTTPNotFound(description=f"Allocation job with ID {job_id} not found")
 
-            resp.media = {"message": "Order allocation completed for all warehouses"}
-            resp.status = falcon.HTTP_200
\ No newline at end of file
+        resp.media = job
+        resp.status = falcon.HTTP_200
@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+import falcon
+from monitoring.metrics import RESPONSE_CACHE_REQUESTS, RESPONSE_CACHE_ENTRIES, RESPONSE_CACHE_BYTES
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 256))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 300))
+
+class ResponseCache:
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, max_bytes=RESPONSE_CACHE_MAX_BYTES, ttl=RESPONSE_CACHE_TTL):
+        """
+        Thread-safe LRU cache of response bodies, keyed by (data version, path, query params).
+
+        Storing a body for a newer data version drops every entry of the older ones, since
+        no request will ask for them again.
+
+        Parameters:
+        max_entries (int): Maximum number of bodies kept, 0 disables the cache.
+        max_bytes (int): Maximum total size of the bodies kept.
+        ttl (float): Seconds a body is served for at most.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get a cached body, marking it as the most recently used.
+
+        Returns:
+        bytes: Cached body, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] >= self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, body):
+        """
+        Store a body, evicting the least recently used ones to stay within the limits.
+
+        Bodies larger than a quarter of max_bytes are not stored.
+        """
+        if self.max_entries <= 0 or len(body) > self.max_bytes // 4:
+            return
+        version = key[0]
+        with self._lock:
+            if self._version is not None and version < self._version:
+                return
+            if version != self._version:
+                self._entries.clear()
+                self._size = 0
+                self._version = version
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (body, time.monotonic())
+            self._size += len(body)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+            RESPONSE_CACHE_ENTRIES.set(len(self._entries))
+            RESPONSE_CACHE_BYTES.set(self._size)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            RESPONSE_CACHE_ENTRIES.set(0)
+            RESPONSE_CACHE_BYTES.set(0)
+
+    def _remove(self, key):
+        body, _ = self._entries.pop(key)
+        self._size -= len(body)
+
+RESPONSE_CACHE = ResponseCache()
+
+def response_key(req, version):
+    """
+    Cache key of a GET request: the data version, the path and the sorted query params.
+    """
+    params = tuple(sorted((name, str(value)) for name, value in req.params.items()))
+    return (version, req.path, params)
+
+def serve_cached(req, resp, version, cache=RESPONSE_CACHE):
+    """
+    Answer the request from the cache if a body for this data version is stored.
+
+    Args:
+        req (falcon.Request): GET request.
+        resp (falcon.Response): Response, receives the cached JSON body on a hit.
+        version (int): Current data version.
+        cache (ResponseCache): Cache to look in.
+
+    Returns:
+        bool: True if the response was served from the cache.
+    """
+    body = cache.get(response_key(req, version))
+    route = req.uri_template or req.path
+    if body is None:
+        RESPONSE_CACHE_REQUESTS.inc(route=route, result="miss")
+        return False
+
+    RESPONSE_CACHE_REQUESTS.inc(route=route, result="hit")
+    resp.status = falcon.HTTP_200
+    resp.content_type = falcon.MEDIA_JSON
+    resp.data = body
+    return True
+
+def caching_stream(req, version, stream, cache=RESPONSE_CACHE):
+    """
+    Pass a response stream through, storing the whole body once it has been sent in full.
+
+    Args:
+        req (falcon.Request): GET request the stream answers.
+        version (int): Data version the body is derived from.
+        stream (iterable): Encoded chunks, as built by app.streaming.stream_json.
+        cache (ResponseCache): Cache to store the body in.
+
+    Returns:
+        generator: The same chunks.
+    """
+    key = response_key(req, version)
+
+    def generate():
+        chunks = []
+        size = 0
+        for chunk in stream:
+            # Stop collecting bodies too large to be stored anyway
+            if chunks is not None:
+                size += len(chunk)
+                if size <= cache.max_bytes // 4:
+                    chunks.append(chunk)
+                else:
+                    chunks = None
+            yield chunk
+        if chunks is not None:
+            cache.put(key, b"".join(chunks))
+    return generate()
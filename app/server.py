@@ -0,0 +1,152 @@
+import os
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+from database.db import engine
+
+SERVER_MODES = ("simple", "threaded", "prefork")
+
+class PooledWSGIServer(WSGIServer):
+    def __init__(self, server_address, threads=8, bind_and_activate=True):
+        """
+        WSGI server handling requests on a fixed-size thread pool.
+
+        Closing the server waits for the requests already accepted to finish.
+
+        Parameters:
+        server_address (tuple): (host, port) to listen on.
+        threads (int): Number of requests handled concurrently.
+        bind_and_activate (bool): Bind and listen right away.
+        """
+        super().__init__(server_address, WSGIRequestHandler, bind_and_activate)
+        self.threads = threads
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="http")
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process_request_thread, request, client_address)
+
+    def _process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=True)
+
+def _stop_on_signals(httpd):
+    # shutdown() blocks until serve_forever returns, so it cannot run in the serving thread
+    def handler(signum, frame):
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, handler)
+    signal.signal(signal.SIGINT, handler)
+
+def serve(app, host="", port=8000, mode="threaded", workers=1, threads=8, on_worker_exit=None):
+    """
+    Serve the WSGI app until SIGTERM or SIGINT, then finish the requests in flight.
+
+    Parameters:
+    app (falcon.App): WSGI application.
+    host (str): Interface to listen on, all interfaces when empty.
+    port (int): Port to listen on.
+    mode (str): "simple" for one request at a time, "threaded" for a thread pool, or
+        "prefork" for `workers` processes sharing the socket, each with its own thread pool.
+    workers (int): Number of processes in prefork mode.
+    threads (int): Threads per process in threaded and prefork mode.
+    on_worker_exit (function, optional): Called in the parent with the PID of every prefork
+        worker that exits, to clean up the work it left unfinished.
+
+    Returns:
+    None
+    """
+    if mode not in SERVER_MODES:
+        raise ValueError(f"Unknown server mode {mode}, expected one of {SERVER_MODES}")
+
+    if mode == "simple":
+        httpd = WSGIServer((host, port), WSGIRequestHandler)
+    else:
+        httpd = PooledWSGIServer((host, port), threads)
+    httpd.set_app(app)
+
+    if mode == "prefork" and workers > 1:
+        _serve_prefork(httpd, workers, on_worker_exit)
+        return
+
+    print(f"Serving on port {port} ({mode}, {threads if mode != 'simple' else 1} threads)...")
+    _stop_on_signals(httpd)
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+        print("Server stopped.")
+
+def _serve_worker(httpd):
+    # Pooled connections inherited from the parent must not be shared across forks
+    engine.dispose(close=False)
+    _stop_on_signals(httpd)
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+
+def _spawn_worker(httpd):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            _serve_worker(httpd)
+        except BaseException as e:
+            print(f"Worker {os.getpid()} failed: {e}")
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+def _serve_prefork(httpd, workers, on_worker_exit=None):
+    """
+    Fork `workers` processes accepting on the parent's listening socket, restart the ones
+    that die, and forward SIGTERM / SIGINT to all of them on shutdown. on_worker_exit is
+    called with the PID of every worker that exits.
+    """
+    stopping = False
+
+    def handler(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    children = set()
+    for _ in range(workers):
+        children.add(_spawn_worker(httpd))
+    signal.signal(signal.SIGTERM, handler)
+    signal.signal(signal.SIGINT, handler)
+    print(f"Serving on port {httpd.server_address[1]} (prefork, {workers} workers x {httpd.threads} threads)...")
+
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if on_worker_exit is not None:
+            try:
+                on_worker_exit(pid)
+            except Exception as e:
+                print(f"Error cleaning up after worker {pid}: {e}")
+        if not stopping:
+            print(f"Worker {pid} exited, starting a new one")
+            children.add(_spawn_worker(httpd))
+
+    httpd.socket.close()
+    print("Server stopped.")
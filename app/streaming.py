@@ -0,0 +1,61 @@
+import json
+import falcon
+
+STREAM_BATCH_SIZE = 500
+
+def not_modified(req, resp, version):
+    """
+    Tag the response with the data version and tell whether the client already has it.
+
+    Args:
+        req (falcon.Request): Request, checked for If-None-Match.
+        resp (falcon.Response): Response, receives the ETag and, on a match, a 304 status.
+        version (int): Data version the response is derived from.
+
+    Returns:
+        bool: True if the client's copy is current and nothing else needs to be sent.
+    """
+    etag = f"v{version}"
+    resp.etag = etag
+    if req.if_none_match and any(tag == "*" or tag == etag for tag in req.if_none_match):
+        resp.status = falcon.HTTP_304
+        return True
+    return False
+
+def json_array_chunks(items, batch_size=STREAM_BATCH_SIZE):
+    """
+    Encode an iterable as the elements of a JSON array, one chunk per batch of items.
+
+    Yields:
+        str: Comma separated JSON values, to be placed between "[" and "]".
+    """
+    batch = []
+    first = True
+    for item in items:
+        batch.append(json.dumps(item))
+        if len(batch) >= batch_size:
+            yield ("" if first else ",") + ",".join(batch)
+            first = False
+            batch = []
+    if batch:
+        yield ("" if first else ",") + ",".join(batch)
+
+def stream_json(get_db, produce):
+    """
+    Build a response stream that runs on a session of its own.
+
+    The request's session is closed before the body is sent, so the rows are read from a
+    session opened when the server starts consuming the stream.
+
+    Args:
+        get_db (function): Function to provide a database session.
+        produce (function): Called with the session, yields the JSON document as str chunks.
+
+    Returns:
+        generator: Encoded chunks for falcon's resp.stream.
+    """
+    def generate():
+        with get_db() as db:
+            for chunk in produce(db):
+                yield chunk.encode("utf-8")
+    return generate()
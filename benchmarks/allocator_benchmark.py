@@ -0,0 +1,257 @@
+import os
+
+# The database package builds its engine on import; the benchmark uses its own engine below
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime
+import numpy as np
+from sqlalchemy import create_engine, insert, func
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from database.db import Base
+from database.models import Warehouse, AgentsBigPic, OrdersBigPic
+from agent_functions.AgentFunctions import earnings_expression
+from warehouse_order_allocation.Order_allocator import OrderAllocator
+from warehouse_order_allocation.distances import DISTANCE_DTYPE
+from monitoring.memory import track_peak_memory
+from .datasets import SCENARIOS, generate_orders
+
+PHASES = ("load", "assign_points_to_sectors", "constrained_kmeans", "greedy_tsp_with_agent", "commit")
+INSERT_CHUNK_SIZE = 50000
+
+class TimedOrderAllocator(OrderAllocator):
+    """
+    OrderAllocator that adds up the wall time spent in each phase of allocate_orders.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Kept apart from OrderAllocator.phase_seconds, which times coarser phases
+        self.method_seconds = {phase: 0.0 for phase in PHASES}
+        self.phase_calls = {phase: 0 for phase in PHASES}
+
+    def _timed(self, phase, method, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            self.method_seconds[phase] += time.perf_counter() - start
+            self.phase_calls[phase] += 1
+
+    def load_agents(self):
+        return self._timed("load", super().load_agents)
+
+    def load_undelivered_orders(self):
+        return self._timed("load", super().load_undelivered_orders)
+
+    def assign_points_to_sectors(self, X, n_sectors):
+        return self._timed("assign_points_to_sectors", super().assign_points_to_sectors, X, n_sectors)
+
+    def constrained_kmeans(self, X, n_clusters, *args, **kwargs):
+        return self._timed("constrained_kmeans", super().constrained_kmeans, X, n_clusters, *args, **kwargs)
+
+    def greedy_tsp_with_agent(self, *args, **kwargs):
+        return self._timed("greedy_tsp_with_agent", super().greedy_tsp_with_agent, *args, **kwargs)
+
+    def flush_assignments(self):
+        return self._timed("commit", super().flush_assignments)
+
+def create_session(database_url):
+    """
+    Create an empty benchmark database and return a session on it.
+
+    Parameters:
+    database_url (str): SQLAlchemy URL, "sqlite://" for an in-memory database.
+
+    Returns:
+    Session: SQLAlchemy session bound to the new database.
+    """
+    if database_url == "sqlite://":
+        engine = create_engine(database_url, poolclass=StaticPool, connect_args={"check_same_thread": False})
+    else:
+        engine = create_engine(database_url)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+def seed_warehouse(session, coords, no_of_agents, warehouse_coords=(0.0, 0.0)):
+    """
+    Insert one warehouse with checked-in agents and the given undelivered orders.
+
+    Returns:
+    Warehouse: The new warehouse.
+    """
+    warehouse = Warehouse(x_coord=warehouse_coords[0], y_coord=warehouse_coords[1])
+    session.add(warehouse)
+    session.flush()
+    session.execute(insert(AgentsBigPic.__table__), [
+        {"warehouse_id": warehouse.id, "no_of_orders": 0, "total_distance": 0.0, "is_checked_in": True}
+        for _ in range(no_of_agents)
+    ])
+    for start in range(0, len(coords), INSERT_CHUNK_SIZE):
+        session.execute(insert(OrdersBigPic.__table__), [
+            {"warehouse_id": warehouse.id, "x_coord": x, "y_coord": y, "is_delivered": False}
+            for x, y in coords[start:start + INSERT_CHUNK_SIZE].tolist()
+        ])
+    session.commit()
+    return warehouse
+
+def run_case(scenario, no_of_orders, no_of_agents, seed=0, database_url="sqlite://", route_time_budget=0.0, verbose=False, trace_memory=False):
+    """
+    Allocate one synthetic warehouse from scratch and measure it.
+
+    With trace_memory the peak memory of the allocation is reported as well, at the cost of
+    slower timings while tracemalloc runs.
+
+    Returns:
+    dict: Phase timings and solution quality of the run.
+    """
+    coords = generate_orders(scenario, no_of_orders, seed)
+    session = create_session(database_url)
+    try:
+        warehouse = seed_warehouse(session, coords, no_of_agents)
+
+        allocator = TimedOrderAllocator(session, warehouse, route_time_budget=route_time_budget)
+        # The allocator's progress prints would otherwise be timed as well
+        output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        with output, track_peak_memory(trace_memory) as memory:
+            start = time.perf_counter()
+            allocated = allocator.allocate_orders()
+            total_seconds = time.perf_counter() - start
+
+        distance, cost = session.query(
+            func.coalesce(func.sum(AgentsBigPic.total_distance), 0.0),
+            func.coalesce(func.sum(earnings_expression()), 0),
+        ).filter(AgentsBigPic.warehouse_id == warehouse.id).one()
+    finally:
+        session.close()
+        session.get_bind().dispose()
+
+    phases = {
+        phase: {"seconds": round(allocator.method_seconds[phase], 6), "calls": allocator.phase_calls[phase]}
+        for phase in PHASES
+    }
+    phases["other"] = {"seconds": round(total_seconds - sum(allocator.method_seconds.values()), 6), "calls": 1}
+
+    return {
+        "scenario": scenario,
+        "orders": no_of_orders,
+        "agents": no_of_agents,
+        "iterations": allocator.iterations,
+        "total_seconds": round(total_seconds, 6),
+        "phases": phases,
+        "orders_allocated": allocated,
+        "orders_per_second": round(allocated / total_seconds, 1) if total_seconds > 0 else None,
+        "km_per_order": round(distance / allocated, 4) if allocated else None,
+        "cost_per_order": round(cost / allocated, 4) if allocated else None,
+        "peak_memory_mb": round(memory["peak_bytes"] / 2 ** 20, 1) if memory["peak_bytes"] is not None else None,
+    }
+
+def median_run(runs):
+    """
+    Combine repeated runs of a case: median timings, quality from the first run.
+    """
+    result = dict(runs[0])
+    result["repeats"] = len(runs)
+    result["total_seconds"] = round(statistics.median(run["total_seconds"] for run in runs), 6)
+    result["phases"] = {
+        phase: dict(info, seconds=round(statistics.median(run["phases"][phase]["seconds"] for run in runs), 6))
+        for phase, info in runs[0]["phases"].items()
+    }
+    if result["orders_allocated"] and result["total_seconds"] > 0:
+        result["orders_per_second"] = round(result["orders_allocated"] / result["total_seconds"], 1)
+    return result
+
+def environment_info():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "created_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+    }
+
+def compare_results(baseline, current):
+    """
+    Print the change of every case present in both result files.
+    """
+    cases = {(r["scenario"], r["orders"], r["agents"]): r for r in baseline["results"]}
+    print(f"{'case':<30}{'seconds':>22}{'allocated':>20}{'km/order':>22}")
+    for result in current["results"]:
+        key = (result["scenario"], result["orders"], result["agents"])
+        old = cases.get(key)
+        if old is None:
+            continue
+        speedup = old["total_seconds"] / result["total_seconds"] if result["total_seconds"] else float("inf")
+        print(
+            f"{'/'.join(map(str, key)):<30}"
+            f"{old['total_seconds']:>9.3f} -> {result['total_seconds']:<7.3f}{speedup:>5.2f}x"
+            f"{old['orders_allocated']:>9} -> {result['orders_allocated']:<8}"
+            f"{old['km_per_order'] or 0:>9.3f} -> {result['km_per_order'] or 0:<9.3f}"
+        )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark OrderAllocator on synthetic warehouses.")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--orders", nargs="+", type=int, default=[1000, 10000])
+    parser.add_argument("--agents", nargs="+", type=int, default=[10, 100])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per case, timings are the median.")
+    parser.add_argument("--database-url", default="sqlite://", help="Defaults to an in-memory SQLite database.")
+    parser.add_argument("--route-time-budget", type=float, default=0.0)
+    parser.add_argument("--verbose", action="store_true", help="Show the allocator's progress output.")
+    parser.add_argument("--trace-memory", action="store_true", help="Report peak memory, timings are slower with it.")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--compare", help="Results file of an earlier run to compare against.")
+    args = parser.parse_args(argv)
+
+    results = []
+    for scenario, no_of_orders, no_of_agents in itertools.product(args.scenarios, args.orders, args.agents):
+        runs = [
+            run_case(
+                scenario, no_of_orders, no_of_agents, args.seed, args.database_url, args.route_time_budget,
+                args.verbose, args.trace_memory,
+            )
+            for _ in range(max(args.repeat, 1))
+        ]
+        result = median_run(runs)
+        results.append(result)
+        print(
+            f"{scenario}/{no_of_orders}/{no_of_agents}: {result['total_seconds']:.3f}s, "
+            f"{result['orders_allocated']} allocated, {result['km_per_order']} km/order"
+            + (f", peak {result['peak_memory_mb']} MB" if result["peak_memory_mb"] is not None else "")
+        )
+
+    report = {
+        "environment": environment_info(),
+        "settings": {
+            "seed": args.seed, "repeat": args.repeat, "route_time_budget": args.route_time_budget,
+            "trace_memory": args.trace_memory, "distance_dtype": DISTANCE_DTYPE.name,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(json.load(f), report)
+    return report
+
+if __name__ == "__main__":
+    main()
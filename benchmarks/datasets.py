@@ -0,0 +1,37 @@
+import numpy as np
+
+SCENARIOS = ("uniform", "clustered", "ring")
+
+def generate_orders(scenario, no_of_orders, seed=0, warehouse_coords=(0.0, 0.0), radius=20):
+    """
+    Generate a deterministic synthetic order field around a warehouse.
+
+    Parameters:
+    scenario (str): "uniform" over the square around the warehouse, "clustered" in a few dense
+        blobs, or "ring" on an annulus around the warehouse.
+    no_of_orders (int): Number of orders to generate.
+    seed (int): Seed, the same (scenario, no_of_orders, seed) always gives the same orders.
+    warehouse_coords (tuple): Coordinates (x, y) of the warehouse.
+    radius (float): Half side of the square orders must fall in.
+
+    Returns:
+    np.ndarray: Array of shape (no_of_orders, 2) rounded to two decimals.
+    """
+    if scenario not in SCENARIOS:
+        raise ValueError(f"Unknown scenario {scenario}, expected one of {SCENARIOS}")
+    rng = np.random.default_rng([seed, SCENARIOS.index(scenario), no_of_orders])
+
+    if scenario == "uniform":
+        offsets = rng.uniform(-radius, radius, size=(no_of_orders, 2))
+    elif scenario == "clustered":
+        n_blobs = 8
+        centres = rng.uniform(-0.75 * radius, 0.75 * radius, size=(n_blobs, 2))
+        blob = rng.integers(0, n_blobs, size=no_of_orders)
+        offsets = centres[blob] + rng.normal(0, radius / 10, size=(no_of_orders, 2))
+    else:
+        angles = rng.uniform(0, 2 * np.pi, size=no_of_orders)
+        distances = rng.normal(0.7 * radius, radius / 15, size=no_of_orders)
+        offsets = np.column_stack([distances * np.cos(angles), distances * np.sin(angles)])
+
+    offsets = np.clip(offsets, -radius, radius)
+    return np.round(offsets + np.asarray(warehouse_coords, dtype=float), 2)
@@ -0,0 +1,82 @@
+import os
+import threading
+import time
+from sqlalchemy import event, insert, update
+from .models import DataVersion
+
+DATA_VERSION_TTL = float(os.getenv("DATA_VERSION_TTL", 1.0))
+
+_cached_version = None
+_cached_at = 0.0
+_invalidations = 0
+_cache_lock = threading.Lock()
+
+def _invalidate(*args):
+    global _cached_version, _invalidations
+    with _cache_lock:
+        _cached_version = None
+        _invalidations += 1
+
+def bump_data_version(session):
+    """
+    Increase the data version in the caller's transaction. Does not commit.
+
+    Every code path changing orders, agents or routes calls this, so responses derived
+    from them can be cached and validated by the version alone.
+
+    Parameters:
+    session (Session): SQLAlchemy session.
+
+    Returns:
+    None
+    """
+    result = session.execute(update(DataVersion).where(DataVersion.id == 1).values(version=DataVersion.version + 1))
+    if result.rowcount == 0:
+        session.execute(insert(DataVersion).values(id=1, version=1))
+    _invalidate()
+    # Readers in this process must not keep the old version once the change is visible
+    event.listen(session, "after_commit", _invalidate, once=True)
+
+def ensure_data_version(session):
+    """
+    Create the data version row if it does not exist yet. Does not commit.
+
+    Run at startup, so concurrent first changes do not both try to insert it.
+    """
+    if session.query(DataVersion.id).filter(DataVersion.id == 1).first() is None:
+        session.execute(insert(DataVersion).values(id=1, version=0))
+
+def read_data_version(session):
+    """
+    Read the data version from the database.
+
+    Returns:
+    int: Current version, 0 before the first change.
+    """
+    version = session.query(DataVersion.version).filter(DataVersion.id == 1).scalar()
+    return version or 0
+
+def current_data_version(session):
+    """
+    Data version, served from memory when it was read less than DATA_VERSION_TTL seconds ago.
+
+    Changes made by this process are seen immediately; changes made by other processes
+    (prefork workers, allocation pool workers) are seen within DATA_VERSION_TTL seconds.
+
+    Parameters:
+    session (Session): SQLAlchemy session, only used when the cached version is stale.
+
+    Returns:
+    int: Current version.
+    """
+    global _cached_version, _cached_at
+    with _cache_lock:
+        if _cached_version is not None and time.monotonic() - _cached_at < DATA_VERSION_TTL:
+            return _cached_version
+        invalidations = _invalidations
+    version = read_data_version(session)
+    with _cache_lock:
+        # A change committed while reading may not be in `version`, so do not keep it
+        if invalidations == _invalidations:
+            _cached_version, _cached_at = version, time.monotonic()
+    return version
@@ -1,21 +1,76 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from contextlib import contextmanager
 from dotenv import load_dotenv
 import os
+from monitoring.metrics import instrument_engine
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL, echo=False)
+# Connection pool settings, ignored for SQLite where the pool sizing does not apply
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", -1))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", 0))  # milliseconds, 0 for none
+
+def engine_options(database_url):
+    """
+    Keyword arguments for create_engine built from the DB_* settings.
+
+    Parameters:
+    database_url (str): SQLAlchemy database URL.
+
+    Returns:
+    dict: Options for create_engine.
+    """
+    options = {"echo": False, "pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    backend = make_url(database_url).get_backend_name()
+    if backend != "sqlite":
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    if backend == "postgresql" and DB_STATEMENT_TIMEOUT > 0:
+        options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT}"}
+    return options
+
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+instrument_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
 def create_tables():
     Base.metadata.create_all(bind=engine)
+    upgrade_schema()
+
+def upgrade_schema():
+    """
+    Bring tables created by an older version up to date with the models.
+
+    create_all only creates missing tables, so columns and indexes added to an existing
+    model are added here. New columns must be nullable or have a server default.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    connection.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+                    print(f"Added column {table.name}.{column.name}")
+
+            existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(connection)
+                    print(f"Created index {index.name}")
 
 @contextmanager
 def get_db():
@@ -24,3 +79,21 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def pool_status():
+    """
+    Report how much of the connection pool is in use.
+
+    Returns:
+    dict: Pool class, size, connections checked in and out, overflow and utilization
+        (checked out connections over the pool's capacity) where the pool reports them.
+    """
+    pool = engine.pool
+    status = {"pool": type(pool).__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        if hasattr(pool, name):
+            status[name] = getattr(pool, name)()
+    if "size" in status and "checkedout" in status:
+        capacity = status["size"] + max(getattr(pool, "_max_overflow", 0), 0)
+        status["utilization"] = round(status["checkedout"] / capacity, 3) if capacity else None
+    return status
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, JSON, Boolean, ForeignKey, Float
+from sqlalchemy import Column, Integer, JSON, Boolean, ForeignKey, Float, String, Text, Date, DateTime, Index
+from datetime import datetime
 from sqlalchemy.orm import relationship
 from .db import Base
 
@@ -18,12 +19,15 @@ class AgentsBigPic(Base):
 
     id = Column(Integer, primary_key=True)
     is_checked_in = Column(Boolean, nullable=False, default=False)
-    orders = Column(JSON)
     no_of_orders = Column(Integer, nullable=False, default=0)
     total_distance = Column(Integer, nullable=False, default=0)
+    last_x = Column(Float)  # Position of the agent's last stop, None while at the warehouse
+    last_y = Column(Float)
+    route_version = Column(Integer, default=0)  # Increased by every change to the agent's route
 
     warehouse_id = Column(Integer, ForeignKey('Warehouse.id'))
     assigned_orders = relationship("OrdersBigPic", back_populates="assigned_agent")
+    route_stops = relationship("RouteStop", back_populates="agent", order_by="RouteStop.seq")
 
     warehouse = relationship("Warehouse", back_populates="agents")
 
@@ -41,3 +45,75 @@ class OrdersBigPic(Base):
 
     assigned_agent = relationship("AgentsBigPic", back_populates="assigned_orders")
     warehouse = relationship("Warehouse", back_populates="orders")
+
+
+# Allocation, OrdersLeft and checkout only ever scan a warehouse's undelivered orders
+Index(
+    "ix_orders_undelivered_warehouse_id",
+    OrdersBigPic.warehouse_id,
+    postgresql_where=OrdersBigPic.is_delivered == False,
+    sqlite_where=OrdersBigPic.is_delivered == False,
+)
+Index("ix_orders_assigned_agent_id", OrdersBigPic.assigned_agent_id)
+
+
+class RouteStop(Base):
+    __tablename__ = "Route_stops"
+
+    # The composite primary key doubles as the (agent_id, seq) index routes are read by
+    agent_id = Column(Integer, ForeignKey('Agents_bigPic.id'), primary_key=True)
+    seq = Column(Integer, primary_key=True)
+    order_id = Column(Integer, ForeignKey('Orders_bigPic.id'), nullable=False)
+    leg_distance = Column(Float, nullable=False, default=0)
+
+    agent = relationship("AgentsBigPic", back_populates="route_stops")
+    order = relationship("OrdersBigPic")
+
+
+class DeliveredOrder(Base):
+    __tablename__ = "Delivered_orders"
+    # On PostgreSQL the table is partitioned by day, see database.order_history
+    __table_args__ = {"postgresql_partition_by": "RANGE (delivery_date)"}
+
+    # Append-only: rows are written once by checkout and never updated.
+    # Order IDs can be reused after their rows are archived, so the checkout time is part of the key.
+    delivery_date = Column(Date, primary_key=True)
+    checked_out_at = Column(DateTime, primary_key=True)
+    order_id = Column(Integer, primary_key=True)
+    x_coord = Column(Float, nullable=False)
+    y_coord = Column(Float, nullable=False)
+    warehouse_id = Column(Integer)
+    agent_id = Column(Integer)
+    seq = Column(Integer)  # Position in the agent's route
+    leg_distance = Column(Float)
+
+
+class WarehouseOrderCounter(Base):
+    __tablename__ = "Warehouse_order_counters"
+
+    warehouse_id = Column(Integer, ForeignKey('Warehouse.id'), primary_key=True)
+    undelivered_orders = Column(Integer, nullable=False, default=0)
+
+
+class DataVersion(Base):
+    __tablename__ = "Data_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class AllocationJob(Base):
+    __tablename__ = "Allocation_jobs"
+
+    id = Column(Integer, primary_key=True)
+    status = Column(String(16), nullable=False, default="queued")
+    warehouse_id = Column(Integer, ForeignKey('Warehouse.id'))  # None allocates every warehouse
+    parallel = Column(Boolean, nullable=False, default=False)
+    workers = Column(Integer)
+    worker_pid = Column(Integer)  # Server process the job is queued in
+    progress = Column(JSON)
+    result = Column(JSON)
+    error = Column(Text)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
@@ -0,0 +1,62 @@
+import os
+from sqlalchemy import select, insert, update, delete, func, and_, bindparam
+from .models import Warehouse, OrdersBigPic, WarehouseOrderCounter
+
+USE_ORDER_COUNTERS = os.getenv("USE_ORDER_COUNTERS", "false").lower() in ("1", "true", "yes")
+
+def count_undelivered_orders(session):
+    """
+    Count undelivered orders per warehouse with a single GROUP BY over the orders table.
+
+    Returns:
+    list: Tuples (warehouse_id, no_of_orders) for every warehouse, ordered by warehouse ID.
+    """
+    return session.query(Warehouse.id, func.count(OrdersBigPic.id)).outerjoin(
+        OrdersBigPic, and_(OrdersBigPic.warehouse_id == Warehouse.id, OrdersBigPic.is_delivered == False)
+    ).group_by(Warehouse.id).order_by(Warehouse.id).all()
+
+def read_order_counters(session):
+    """
+    Read the maintained undelivered order counters.
+
+    Returns:
+    list: Tuples (warehouse_id, no_of_orders) ordered by warehouse ID.
+    """
+    return session.query(WarehouseOrderCounter.warehouse_id, WarehouseOrderCounter.undelivered_orders).order_by(
+        WarehouseOrderCounter.warehouse_id
+    ).all()
+
+def refresh_order_counters(session):
+    """
+    Rebuild the counters from the orders table. Does not commit.
+
+    Returns:
+    None
+    """
+    undelivered = select(Warehouse.id, func.count(OrdersBigPic.id)).outerjoin(
+        OrdersBigPic, and_(OrdersBigPic.warehouse_id == Warehouse.id, OrdersBigPic.is_delivered == False)
+    ).group_by(Warehouse.id)
+    session.execute(delete(WarehouseOrderCounter))
+    session.execute(insert(WarehouseOrderCounter).from_select(["warehouse_id", "undelivered_orders"], undelivered))
+
+def bump_order_counters(session, deltas):
+    """
+    Add per-warehouse deltas to the counters in the caller's transaction. Does not commit.
+
+    Parameters:
+    session (Session): SQLAlchemy session.
+    deltas (dict): Warehouse ID -> change in undelivered orders.
+
+    Returns:
+    None
+    """
+    params = [{"w_id": int(warehouse_id), "delta": int(delta)} for warehouse_id, delta in deltas.items() if delta]
+    if not params:
+        return
+    table = WarehouseOrderCounter.__table__
+    session.execute(
+        update(table).where(table.c.warehouse_id == bindparam("w_id")).values(
+            undelivered_orders=table.c.undelivered_orders + bindparam("delta")
+        ),
+        params
+    )
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+from sqlalchemy import delete, insert, select, literal, text
+from .models import OrdersBigPic, RouteStop, DeliveredOrder
+
+def history_partition_name(day):
+    return f"{DeliveredOrder.__tablename__}_{day:%Y%m%d}"
+
+def ensure_history_partition(session, day):
+    """
+    Create the day's partition of the delivered orders table on PostgreSQL. Does not commit.
+
+    Other databases keep the history in a single table, so nothing is done for them.
+
+    Parameters:
+    session (Session): SQLAlchemy session.
+    day (date): Delivery date the partition holds.
+
+    Returns:
+    None
+    """
+    if session.get_bind().dialect.name != "postgresql":
+        return
+    session.execute(text(
+        f'CREATE TABLE IF NOT EXISTS "{history_partition_name(day)}" PARTITION OF "{DeliveredOrder.__tablename__}" '
+        f"FOR VALUES FROM ('{day.isoformat()}') TO ('{(day + timedelta(days=1)).isoformat()}')"
+    ))
+
+def archive_delivered_orders(session, day=None):
+    """
+    Move every delivered order, with its route position, to the delivered orders history and
+    clear the routes, with one INSERT ... SELECT and two bulk deletes. Does not commit.
+
+    Only undelivered orders stay in the orders table, so allocation scans do not grow with
+    the history.
+
+    Parameters:
+    session (Session): SQLAlchemy session.
+    day (date, optional): Delivery date recorded for the orders, defaults to the UTC date of
+        the checkout so that it agrees with checked_out_at.
+
+    Returns:
+    int: Number of orders archived.
+    """
+    checked_out_at = datetime.utcnow()
+    day = day or checked_out_at.date()
+    ensure_history_partition(session, day)
+
+    delivered = select(
+        literal(day, DeliveredOrder.delivery_date.type),
+        literal(checked_out_at, DeliveredOrder.checked_out_at.type),
+        OrdersBigPic.id,
+        OrdersBigPic.x_coord,
+        OrdersBigPic.y_coord,
+        OrdersBigPic.warehouse_id,
+        OrdersBigPic.assigned_agent_id,
+        RouteStop.seq,
+        RouteStop.leg_distance,
+    ).outerjoin(RouteStop, RouteStop.order_id == OrdersBigPic.id).where(OrdersBigPic.is_delivered == True)
+
+    archived = session.execute(insert(DeliveredOrder).from_select([
+        "delivery_date", "checked_out_at", "order_id", "x_coord", "y_coord",
+        "warehouse_id", "agent_id", "seq", "leg_distance",
+    ], delivered)).rowcount
+
+    # Stops reference the orders, so they go first
+    session.execute(delete(RouteStop))
+    session.execute(delete(OrdersBigPic).where(OrdersBigPic.is_delivered == True))
+    return archived
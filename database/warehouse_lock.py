@@ -0,0 +1,80 @@
+import threading
+from contextlib import contextmanager
+from sqlalchemy import func, select, text
+
+# First key of the PostgreSQL advisory locks taken here, the warehouse ID is the second
+ALLOCATION_LOCK_NAMESPACE = 7301
+
+_local_locks = {}
+_local_locks_guard = threading.Lock()
+
+def _local_lock(warehouse_id):
+    with _local_locks_guard:
+        return _local_locks.setdefault(warehouse_id, threading.Lock())
+
+@contextmanager
+def warehouse_allocation_lock(session, warehouse_id):
+    """
+    Hold the warehouse's allocation lock while the block runs, waiting for it if another
+    allocation of the warehouse holds it.
+
+    The allocator commits once per iteration, so on PostgreSQL the lock is a session-level
+    advisory lock held on a connection of its own for the whole run rather than a transaction
+    lock. Threads of the same process also share an in-process lock, which is the only lock
+    on other databases. The wait for the advisory lock is not limited by DB_STATEMENT_TIMEOUT.
+
+    Parameters:
+    session (Session): SQLAlchemy session of the allocation.
+    warehouse_id (int): ID of the warehouse.
+
+    Returns:
+    None
+    """
+    with _local_lock(warehouse_id):
+        engine = session.get_bind()
+        if engine.dialect.name != "postgresql":
+            yield
+            return
+
+        with engine.connect() as connection:
+            # Waiting for the lock is queuing behind another run, which DB_STATEMENT_TIMEOUT
+            # must not cancel. The pooled connection gets its own timeout back afterwards.
+            connection.execute(text("SET statement_timeout = 0"))
+            try:
+                connection.execute(select(func.pg_advisory_lock(ALLOCATION_LOCK_NAMESPACE, warehouse_id)))
+                try:
+                    yield
+                finally:
+                    connection.execute(select(func.pg_advisory_unlock(ALLOCATION_LOCK_NAMESPACE, warehouse_id)))
+            finally:
+                connection.execute(text("RESET statement_timeout"))
+
+@contextmanager
+def try_warehouse_allocation_lock(session, warehouse_id):
+    """
+    Take the warehouse's allocation lock without waiting for it.
+
+    On PostgreSQL the lock is a transaction-level advisory lock taken in the session's own
+    transaction, so the block must commit or roll back before it exits.
+
+    Parameters:
+    session (Session): SQLAlchemy session.
+    warehouse_id (int): ID of the warehouse.
+
+    Yields:
+    bool: True if the lock was taken, False if an allocation of the warehouse holds it.
+    """
+    lock = _local_lock(warehouse_id)
+    if not lock.acquire(blocking=False):
+        yield False
+        return
+    try:
+        if session.get_bind().dialect.name == "postgresql":
+            locked = session.execute(
+                select(func.pg_try_advisory_xact_lock(ALLOCATION_LOCK_NAMESPACE, warehouse_id))
+            ).scalar()
+        else:
+            locked = True
+        yield bool(locked)
+    finally:
+        lock.release()
@@ -1,19 +1,35 @@
 from database.db import create_tables
 from database.models import *
-from wsgiref.simple_server import make_server
+import os
 from app.routes import app
+from app.server import serve
+from database.db import get_db
+from database.order_counters import refresh_order_counters
+from database.data_version import ensure_data_version
+from warehouse_order_allocation.allocation_jobs import recover_interrupted_jobs
 
 def main():
     try:
         create_tables()
         print("Tables created!")
+        recover_interrupted_jobs(get_db)
+        with get_db() as db:
+            refresh_order_counters(db)
+            ensure_data_version(db)
+            db.commit()
     except Exception as e:
         print(f"Error occured {e}")
-    with make_server('', 8000, app) as httpd:
-        print('Serving on port 8000...')
 
-        # Serve until process is killed
-        httpd.serve_forever()
+    # Serve until SIGTERM / SIGINT
+    serve(
+        app,
+        port=int(os.getenv("PORT", 8000)),
+        mode=os.getenv("SERVER_MODE", "threaded"),
+        workers=int(os.getenv("SERVER_WORKERS", os.cpu_count() or 1)),
+        threads=int(os.getenv("SERVER_THREADS", 8)),
+        # Jobs queued in a prefork worker die with it
+        on_worker_exit=lambda pid: recover_interrupted_jobs(get_db, worker_pid=pid),
+    )
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,57 @@
+import os
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# tracemalloc slows down allocations, so peak memory is only traced when asked for
+TRACE_MEMORY = os.getenv("TRACE_MEMORY", "false").lower() in ("1", "true", "yes")
+
+_lock = threading.Lock()
+_active = 0
+# Highest traced memory each active tracker has seen, kept across the peak resets of newer trackers
+_tracker_peaks = {}
+_started = False  # Whether the trackers started tracemalloc, and so should stop it
+
+@contextmanager
+def track_peak_memory(enabled=None):
+    """
+    Measure the peak memory allocated while the block runs, NumPy arrays included.
+
+    tracemalloc is started by the first active tracker and stopped by the last one, unless
+    it was already running. Its peak is process-wide, so blocks running concurrently in
+    other threads of the process add to each other's peak. A tracker starting resets that
+    peak, so the peak reached until then is first saved for the trackers already running.
+
+    Parameters:
+    enabled (bool, optional): Trace the block, TRACE_MEMORY when omitted.
+
+    Yields:
+    dict: Receives "peak_bytes" when the block exits, None when tracing is disabled.
+    """
+    global _active, _started
+    result = {"peak_bytes": None}
+    if not (TRACE_MEMORY if enabled is None else enabled):
+        yield result
+        return
+
+    with _lock:
+        if _active == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started = True
+        _active += 1
+        peak = tracemalloc.get_traced_memory()[1]
+        for tracker in _tracker_peaks:
+            _tracker_peaks[tracker] = max(_tracker_peaks[tracker], peak)
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        _tracker_peaks[id(result)] = baseline
+    try:
+        yield result
+    finally:
+        with _lock:
+            peak = max(tracemalloc.get_traced_memory()[1], _tracker_peaks.pop(id(result)))
+            result["peak_bytes"] = max(peak - baseline, 0)
+            _active -= 1
+            if _active == 0 and _started:
+                tracemalloc.stop()
+                _started = False
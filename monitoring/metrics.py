@@ -0,0 +1,238 @@
+import math
+import threading
+from sqlalchemy import event
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        """
+        Base class of the metric types, one value (or histogram) per combination of label values.
+
+        Parameters:
+        name (str): Metric name.
+        documentation (str): Help text shown in the exposition output.
+        labelnames (tuple): Names of the labels every sample carries.
+        registry (Registry, optional): Registry to add the metric to, REGISTRY when omitted.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labelvalues, value in items:
+            lines.extend(self._render_sample(labelvalues, value))
+        return lines
+
+    def _render_sample(self, labelvalues, value):
+        return [f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"]
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _render_sample(self, labelvalues, state):
+        bucket_counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, bucket_counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, labelvalues, [("le", _format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, labelvalues)
+        lines.append(f"{self.name}_sum{labels} {_format_value(float(total))}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        """
+        Collection of metrics rendered together in the text exposition format.
+        """
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if any(existing.name == metric.name for existing in self._metrics):
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics.append(metric)
+
+    def render(self):
+        """
+        Returns:
+        str: Every registered metric in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Latency of HTTP requests by route.", ("method", "route", "status")
+)
+DB_STATEMENTS = Counter(
+    "db_statements_total", "SQL statements sent to the database, by statement type.", ("operation",)
+)
+ALLOCATION_RUNS = Counter(
+    "allocation_runs_total", "Order allocation runs by warehouse and outcome.", ("warehouse_id", "status")
+)
+ALLOCATION_ITERATIONS = Counter(
+    "allocation_iterations_total", "Clustering iterations run by the order allocator.", ("warehouse_id",)
+)
+ALLOCATION_ORDERS = Counter(
+    "allocation_orders_allocated_total", "Orders allocated to agents.", ("warehouse_id",)
+)
+ALLOCATION_DURATION = Histogram(
+    "allocation_duration_seconds", "Wall time of an order allocation run.", ("warehouse_id",)
+)
+ALLOCATION_PHASE_DURATION = Histogram(
+    "allocation_phase_duration_seconds", "Time an allocation run spent in each phase.", ("phase",)
+)
+ALLOCATION_ORDERS_PER_SECOND = Gauge(
+    "allocation_orders_per_second", "Orders allocated per second in the last run of each warehouse.", ("warehouse_id",)
+)
+ALLOCATION_PEAK_MEMORY = Gauge(
+    "allocation_peak_memory_bytes", "Peak memory allocated by the last traced run of each warehouse.", ("warehouse_id",)
+)
+
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections", "Connections of the database pool by state.", ("state",)
+)
+DB_POOL_UTILIZATION = Gauge(
+    "db_pool_utilization", "Checked out connections over the pool capacity.", ()
+)
+
+RESPONSE_CACHE_REQUESTS = Counter(
+    "response_cache_requests_total", "Cacheable GET requests by route and cache result.", ("route", "result")
+)
+RESPONSE_CACHE_ENTRIES = Gauge(
+    "response_cache_entries", "Response bodies held in the response cache.", ()
+)
+RESPONSE_CACHE_BYTES = Gauge(
+    "response_cache_bytes", "Total size of the response bodies held in the response cache.", ()
+)
+
+def observe_pool(status):
+    """
+    Record a pool status as returned by database.db.pool_status.
+
+    Parameters:
+    status (dict): Pool size, checked in, checked out and overflow connections.
+
+    Returns:
+    None
+    """
+    for state in ("size", "checkedin", "checkedout", "overflow"):
+        if state in status:
+            DB_POOL_CONNECTIONS.set(status[state], state=state)
+    if status.get("utilization") is not None:
+        DB_POOL_UTILIZATION.set(status["utilization"])
+
+def observe_allocation(summary):
+    """
+    Record the metrics of one finished warehouse allocation.
+
+    Parameters:
+    summary (dict): Summary as returned by allocate_warehouse.
+
+    Returns:
+    None
+    """
+    warehouse_id = summary["warehouse_id"]
+    ALLOCATION_RUNS.inc(warehouse_id=warehouse_id, status=summary["status"])
+    if summary["status"] != "completed":
+        return
+
+    elapsed = summary.get("elapsed_seconds", 0)
+    ALLOCATION_DURATION.observe(elapsed, warehouse_id=warehouse_id)
+    ALLOCATION_ITERATIONS.inc(summary.get("iterations", 0), warehouse_id=warehouse_id)
+    ALLOCATION_ORDERS.inc(summary["orders_allocated"], warehouse_id=warehouse_id)
+    if elapsed > 0:
+        ALLOCATION_ORDERS_PER_SECOND.set(summary["orders_allocated"] / elapsed, warehouse_id=warehouse_id)
+    for phase, seconds in summary.get("phase_seconds", {}).items():
+        ALLOCATION_PHASE_DURATION.observe(seconds, phase=phase)
+    if summary.get("peak_memory_bytes") is not None:
+        ALLOCATION_PEAK_MEMORY.set(summary["peak_memory_bytes"], warehouse_id=warehouse_id)
+
+def instrument_engine(engine):
+    """
+    Count every statement the engine executes in DB_STATEMENTS.
+
+    Parameters:
+    engine (Engine): SQLAlchemy engine.
+
+    Returns:
+    None
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        DB_STATEMENTS.inc(operation=operation)
@@ -1,34 +1,348 @@
 from database.models import Warehouse,OrdersBigPic
-from random import randint,uniform
+from database.order_counters import bump_order_counters
+from database.data_version import bump_data_version
+from sqlalchemy import insert
+import numpy as np
+import codecs
+import json
+import math
+import io
 
-def generate_random_orders(session):
+ORDER_DISTRIBUTIONS = ("uniform", "normal")
+INSERT_CHUNK_SIZE = 100000
+
+def generate_order_coords(rng, warehouse_coords, no_of_orders, distribution="uniform", radius=20):
+    """
+    Draw order coordinates around a warehouse in one vectorized call.
+
+    Parameters:
+    rng (np.random.Generator): Random number generator.
+    warehouse_coords (tuple): Coordinates (x, y) of the warehouse.
+    no_of_orders (int): Number of orders to draw.
+    distribution (str): "uniform" over the square around the warehouse, or "normal" centred on it.
+    radius (float): Half side of the square orders must fall in.
+
+    Returns:
+    np.ndarray: Array of shape (no_of_orders, 2) rounded to two decimals.
+    """
+    if distribution == "uniform":
+        offsets = rng.uniform(-radius, radius, size=(no_of_orders, 2))
+    elif distribution == "normal":
+        offsets = np.clip(rng.normal(0, radius / 3, size=(no_of_orders, 2)), -radius, radius)
+    else:
+        raise ValueError(f"Unknown distribution {distribution}, expected one of {ORDER_DISTRIBUTIONS}")
+    return np.round(offsets + np.asarray(warehouse_coords, dtype=float), 2)
+
+def bulk_insert_orders(session, warehouse_id, coords):
+    """
+    Insert orders for a warehouse in chunks, with PostgreSQL COPY when the driver supports it
+    and an executemany INSERT otherwise.
+
+    Parameters:
+    session (Session): SQLAlchemy session.
+    warehouse_id (int): ID of the warehouse the orders belong to.
+    coords (np.ndarray): Array of shape (n, 2) with order coordinates.
+
+    Returns:
+    int: Number of orders inserted.
+    """
+    dbapi_connection = session.connection().connection
+    use_copy = session.get_bind().dialect.name == "postgresql"
+
+    for start in range(0, len(coords), INSERT_CHUNK_SIZE):
+        chunk = coords[start:start + INSERT_CHUNK_SIZE]
+        if use_copy:
+            cursor = dbapi_connection.cursor()
+            if hasattr(cursor, "copy_expert"):
+                buffer = io.StringIO()
+                np.savetxt(buffer, chunk, fmt=f"%.2f,%.2f,{int(warehouse_id)},f")
+                buffer.seek(0)
+                cursor.copy_expert(
+                    f'COPY "{OrdersBigPic.__tablename__}" (x_coord, y_coord, warehouse_id, is_delivered) FROM STDIN WITH CSV',
+                    buffer
+                )
+                cursor.close()
+                continue
+            cursor.close()
+            use_copy = False
+        session.execute(
+            insert(OrdersBigPic.__table__),
+            [
+                {"warehouse_id": warehouse_id, "x_coord": x, "y_coord": y, "is_delivered": False}
+                for x, y in chunk.tolist()
+            ]
+        )
+    return len(coords)
+
+def generate_random_orders(session, no_of_orders=None, distribution="uniform", seed=None):
+    """
+    Generate random orders for every warehouse and insert them in bulk.
+
+    Parameters:
+    session (Session): SQLAlchemy session.
+    no_of_orders (int, optional): Orders per warehouse, a random count between 600 and 1200 when omitted.
+    distribution (str): Spatial distribution of the orders, see generate_order_coords.
+    seed (int, optional): Seed for reproducible order sets.
+
+    Returns:
+    int: 1 if the orders were uploaded, 0 otherwise.
+    """
     try:
-        warehouse_info = session.query(Warehouse).all()
-        for warehouse in warehouse_info:
-            no_of_orders = randint(600,1200)
-            for i in range(no_of_orders):
-                wh_id = warehouse.id
-                wh_x = warehouse.x_coord
-                wh_y = warehouse.y_coord
-                x = round(uniform(wh_x-20,wh_x+20),2)
-                y = round(uniform(wh_y-20,wh_y+20),2)
-                order_dict = {"warehouse_id":wh_id,"x_coord":x,"y_coord":y}
-                order_ob = OrdersBigPic(**order_dict)
-                session.add(order_ob)
-            session.commit()
+        rng = np.random.default_rng(seed)
+        warehouse_info = session.query(Warehouse.id, Warehouse.x_coord, Warehouse.y_coord).order_by(Warehouse.id).all()
+        deltas = {}
+        for wh_id, wh_x, wh_y in warehouse_info:
+            n_orders = no_of_orders if no_of_orders is not None else int(rng.integers(600, 1201))
+            coords = generate_order_coords(rng, (wh_x, wh_y), n_orders, distribution)
+            deltas[wh_id] = bulk_insert_orders(session, wh_id, coords)
+        bump_order_counters(session, deltas)
+        bump_data_version(session)
+        session.commit()
         return 1
     except Exception as e:
-        session.rollback()  
-        print(f"Error generating orders: {e}")  
-        return 0  
+        session.rollback()
+        print(f"Error generating orders: {e}")
+        return 0
 
 def upload_warehouse_orders(session,order_dict):
+    """
+    Insert a single order.
+
+    Parameters:
+    session (Session): SQLAlchemy session.
+    order_dict (dict): Order with warehouse_id, x_coord and y_coord.
+
+    Returns:
+    int: ID of the new order, 0 if it could not be uploaded.
+    """
     try:
         orders_ob = OrdersBigPic(**order_dict)
         session.add(orders_ob)
+        bump_order_counters(session, {orders_ob.warehouse_id: 1})
+        bump_data_version(session)
         session.commit()
-        return 1
+        return orders_ob.id
     except Exception as e:
         session.rollback()  
         print(f"Error generating orders: {e}")  
-        return 0  
\ No newline at end of file
+        return 0  
+
+STREAM_READ_SIZE = 65536
+MAX_ROW_BYTES = 1048576
+MAX_REPORTED_ERRORS = 1000
+NUMBER_CHARS = frozenset("0123456789+-.eE")
+
+def _iter_text(stream):
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    while True:
+        data = stream.read(STREAM_READ_SIZE)
+        if not data:
+            tail = decoder.decode(b"", final=True)
+            if tail:
+                yield tail
+            return
+        yield decoder.decode(data)
+
+def iter_ndjson_rows(stream):
+    """
+    Lazily parse a newline delimited JSON body.
+
+    Parameters:
+    stream (file-like): Binary request stream.
+
+    Yields:
+    tuple: (position, row, error) for every non-blank line, where position is {"line": n} with the
+    1-based line number and exactly one of row and error is None.
+    """
+    buffer = ""
+    line_number = 0
+    for text in _iter_text(stream):
+        buffer += text
+        *lines, buffer = buffer.split("\n")
+        if len(buffer) > MAX_ROW_BYTES:
+            raise ValueError(f"Row larger than {MAX_ROW_BYTES} bytes at line {line_number + len(lines) + 1}")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield ({"line": line_number},) + _decode_row(line)
+    if buffer.strip():
+        yield ({"line": line_number + 1},) + _decode_row(buffer)
+
+def _decode_row(line):
+    try:
+        return json.loads(line), None
+    except ValueError as e:
+        return None, f"Invalid JSON: {e}"
+
+def iter_json_array_rows(stream):
+    """
+    Lazily parse a JSON array body one element at a time.
+
+    Elements must be separated by exactly one comma, and only whitespace may follow the
+    closing bracket.
+
+    Parameters:
+    stream (file-like): Binary request stream.
+
+    Yields:
+    tuple: ({"index": i}, row, None) for every element of the array.
+
+    Raises:
+    ValueError: If the body is not a well-formed JSON array.
+    """
+    decoder = json.JSONDecoder()
+    chunks = _iter_text(stream)
+    buffer = ""
+    pos = 0
+    offset = 0  # Characters dropped from the front of the buffer so far
+    eof = False
+    index = 0
+    # What comes next: the opening bracket, the first element or "]", an element after a
+    # comma, a comma or "]" after an element, or nothing but whitespace after the array
+    expect = "open"
+
+    def fill():
+        nonlocal buffer, pos, offset, eof
+        text = next(chunks, None)
+        if text is None:
+            eof = True
+        else:
+            offset += pos
+            buffer = buffer[pos:] + text
+            pos = 0
+
+    while True:
+        while pos < len(buffer) and buffer[pos].isspace():
+            pos += 1
+        if pos >= len(buffer):
+            if not eof:
+                fill()
+                continue
+            if expect == "end":
+                return
+            raise ValueError("Unexpected end of JSON array")
+
+        char = buffer[pos]
+        if expect == "open":
+            if char != "[":
+                raise ValueError("Expected a JSON array")
+            expect = "first"
+            pos += 1
+            continue
+        if expect == "end":
+            raise ValueError(f"Unexpected data after the JSON array at character {offset + pos}")
+        if expect == "separator":
+            if char == ",":
+                expect = "element"
+            elif char == "]":
+                expect = "end"
+            else:
+                raise ValueError(f"Expected ',' or ']' at character {offset + pos}")
+            pos += 1
+            continue
+        if char == "]" and expect == "first":
+            expect = "end"
+            pos += 1
+            continue
+        if char in ",]":
+            raise ValueError(f"Expected an array element at character {offset + pos}")
+
+        try:
+            row, end = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            # The element may just be cut off at the end of the buffer
+            if eof or len(buffer) - pos > MAX_ROW_BYTES:
+                raise ValueError(f"Invalid JSON array element at character {offset + pos}")
+            fill()
+            continue
+        if not eof and isinstance(row, (int, float)) and not isinstance(row, bool) and all(
+            c in NUMBER_CHARS for c in buffer[end:]
+        ):
+            # A number at the end of the buffer may continue in the next chunk ("6." or "6.7e")
+            fill()
+            continue
+        pos = end
+        expect = "separator"
+        yield {"index": index}, row, None
+        index += 1
+
+def validate_order_row(row, warehouse_ids):
+    """
+    Validate one uploaded order and convert it to insert parameters.
+
+    Parameters:
+    row (dict): Order with warehouse_id, x_coord and y_coord.
+    warehouse_ids (set): IDs of the existing warehouses.
+
+    Returns:
+    tuple: (params, error) where exactly one of the two is None.
+    """
+    if not isinstance(row, dict):
+        return None, "Order must be a JSON object"
+    try:
+        warehouse_id = int(row["warehouse_id"])
+        x_coord = float(row["x_coord"])
+        y_coord = float(row["y_coord"])
+    except KeyError as e:
+        return None, f"Missing field {e.args[0]}"
+    except (TypeError, ValueError) as e:
+        return None, f"Invalid value: {e}"
+    if not (math.isfinite(x_coord) and math.isfinite(y_coord)):
+        return None, "Coordinates must be finite numbers"
+    if warehouse_id not in warehouse_ids:
+        return None, f"Warehouse {warehouse_id} does not exist"
+    return {"warehouse_id": warehouse_id, "x_coord": x_coord, "y_coord": y_coord, "is_delivered": False}, None
+
+def upload_orders_batch(session, rows, chunk_size=1000):
+    """
+    Validate and insert a stream of orders in bulk chunks within one transaction.
+
+    Only one chunk of rows is held in memory at a time, so the body can be of any size.
+
+    Parameters:
+    session (Session): SQLAlchemy session.
+    rows (iterable): (position, row, error) tuples as produced by iter_ndjson_rows or iter_json_array_rows.
+    chunk_size (int): Number of valid orders inserted per executemany.
+
+    Returns:
+    dict: Number of orders inserted and failed, and the position (NDJSON line number or array
+    index) and reason of the first failures.
+    """
+    warehouse_ids = {warehouse_id for (warehouse_id,) in session.query(Warehouse.id)}
+    inserted = 0
+    failed = 0
+    errors = []
+    chunk = []
+    deltas = {}
+
+    def flush_chunk():
+        nonlocal inserted, chunk
+        if chunk:
+            session.execute(insert(OrdersBigPic.__table__), chunk)
+            inserted += len(chunk)
+            for params in chunk:
+                deltas[params["warehouse_id"]] = deltas.get(params["warehouse_id"], 0) + 1
+            chunk = []
+
+    try:
+        for position, row, error in rows:
+            params = None
+            if error is None:
+                params, error = validate_order_row(row, warehouse_ids)
+            if error is not None:
+                failed += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({**position, "error": error})
+                continue
+            chunk.append(params)
+            if len(chunk) >= chunk_size:
+                flush_chunk()
+        flush_chunk()
+        bump_order_counters(session, deltas)
+        bump_data_version(session)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+    return {"inserted": inserted, "failed": failed, "errors": errors}
@@ -1,5 +1,5 @@
 from prefect import flow
-from tasks import upload_orders, agent_checkin, order_allocation, agent_checkout,show_agent_day_info,show_orders_by_agent,orders_left
+from tasks import upload_orders, agent_checkin, order_allocation, agent_checkout,show_agent_day_info,show_orders_by_agent,orders_left,fetch_all_routes
 
 @flow
 def daily_process_flow():
@@ -15,9 +15,12 @@ def daily_process_flow():
 
         show_agent_day_info()
 
-        for agent_id in range(1,201,1):
-            status = show_orders_by_agent(agent_id)
-            if status!=1:
+        # Fetch every route in one request and create the artifacts concurrently
+        routes = fetch_all_routes()
+        agent_ids = [route["agent_id"] for route in routes]
+        statuses = show_orders_by_agent.map(agent_ids, [route["orders"] for route in routes])
+        for agent_id, status in zip(agent_ids, statuses):
+            if status.result()!=1:
                 print(f"No artifact created for agent-{agent_id}")
 
         orders_left()
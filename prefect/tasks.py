@@ -3,32 +3,43 @@ import requests
 from prefect.artifacts import create_table_artifact,create_markdown_artifact
 from dotenv import load_dotenv
 import os
+import time
 
 load_dotenv()
 
 BASE_URL = os.getenv("BASE_URL")
 
+# One keep-alive session shared by every task instead of a new connection per request
+http = requests.Session()
+
 @task
 def upload_orders():
-    response = requests.post(f"{BASE_URL}/upload-orders/")
+    response = http.post(f"{BASE_URL}/upload-orders/")
     print(f"{BASE_URL}/upload_orders/")
     return response.json()
 
 @task
 def agent_checkin():
-    response = requests.post(f"{BASE_URL}/auto-checkin/")
+    response = http.post(f"{BASE_URL}/auto-checkin/")
     return response.json()
 
 @task
-def order_allocation():
-    response = requests.post(f"{BASE_URL}/allocate-all-orders")
-    return response.json()
+def order_allocation(poll_interval=5):
+    response = http.post(f"{BASE_URL}/allocate-all-orders", params={"parallel": "true", "async": "true"})
+    job_id = response.json()["job_id"]
+
+    # Poll the job instead of holding the request open for the whole allocation
+    while True:
+        job = http.get(f"{BASE_URL}/allocation-jobs/{job_id}").json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(poll_interval)
 
 from prefect.artifacts import create_table_artifact
 
 @task
 def show_agent_day_info():
-    response = requests.get(f"{BASE_URL}/agents-day-summary")
+    response = http.get(f"{BASE_URL}/agents-day-summary")
     agent_info = response.json()
     
     rows = [
@@ -65,17 +76,23 @@ def show_agent_day_info():
     return agent_info
 
 @task
-def show_orders_by_agent(agent_id):
+def fetch_all_routes():
+    response = http.get(f"{BASE_URL}/assigned-orders")
+    return response.json().get("routes", [])
+
+@task
+def show_orders_by_agent(agent_id, orders=None):
     try:
-        response = requests.get(f"{BASE_URL}/assigned-orders/{agent_id}")
-        orders_info = response.json()
+        if orders is None:
+            response = http.get(f"{BASE_URL}/assigned-orders/{agent_id}")
+            orders = response.json().get("orders", [])
         rows = [
             {
                 "id": order["id"],
                 "x_coord": order["x_coord"],
                 "y_coord": order["y_coord"]
             }
-            for order in orders_info.get("orders", [])
+            for order in orders
         ]
 
         create_table_artifact(
@@ -89,7 +106,7 @@ def show_orders_by_agent(agent_id):
 
 @task
 def orders_left():
-    response = requests.get(f"{BASE_URL}/orders-left/")
+    response = http.get(f"{BASE_URL}/orders-left/")
     orders_info = response.json()
 
     rows = [
@@ -110,5 +127,5 @@ def orders_left():
 
 @task
 def agent_checkout():
-    response = requests.post(f"{BASE_URL}/checkout/")
+    response = http.post(f"{BASE_URL}/checkout/")
     return response.json()
\ No newline at end of file
@@ -0,0 +1,15 @@
+import os
+import pytest
+
+# The database package builds its engine on import
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+@pytest.fixture
+def session():
+    """
+    Session on a fresh in-memory SQLite database with every table created.
+    """
+    from benchmarks.allocator_benchmark import create_session
+    session = create_session("sqlite://")
+    yield session
+    session.close()
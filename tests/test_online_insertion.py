@@ -0,0 +1,47 @@
+from contextlib import contextmanager
+import numpy as np
+from sqlalchemy import insert, update
+from benchmarks.allocator_benchmark import seed_warehouse
+from database.models import AgentsBigPic, OrdersBigPic, RouteStop, WarehouseOrderCounter
+from warehouse_order_allocation import online_insertion
+from warehouse_order_allocation.online_insertion import insert_order_into_route
+
+def seed(session):
+    warehouse = seed_warehouse(session, np.array([[1.0, 1.0]]), no_of_agents=2)
+    session.execute(insert(WarehouseOrderCounter).values(warehouse_id=warehouse.id, undelivered_orders=1))
+    session.commit()
+    order_id = session.query(OrdersBigPic.id).scalar()
+    agent_ids = [agent_id for (agent_id,) in session.query(AgentsBigPic.id).order_by(AgentsBigPic.id)]
+    return order_id, agent_ids
+
+def test_insert_order_into_route(session):
+    order_id, agent_ids = seed(session)
+
+    agent_id = insert_order_into_route(session, order_id)
+
+    assert agent_id in agent_ids
+    assert session.query(OrdersBigPic.is_delivered, OrdersBigPic.assigned_agent_id).one() == (True, agent_id)
+    assert session.query(RouteStop.agent_id, RouteStop.seq, RouteStop.order_id).all() == [(agent_id, 0, order_id)]
+    assert session.query(WarehouseOrderCounter.undelivered_orders).scalar() == 0
+
+def test_order_delivered_before_the_lock_is_taken(session, monkeypatch):
+    order_id, agent_ids = seed(session)
+    other_agent = agent_ids[-1]
+
+    @contextmanager
+    def allocated_meanwhile(session, warehouse_id):
+        # An allocation run assigns the order and releases the lock just before it is taken
+        session.execute(
+            update(OrdersBigPic).where(OrdersBigPic.id == order_id).values(is_delivered=True, assigned_agent_id=other_agent)
+        )
+        session.execute(update(WarehouseOrderCounter).values(undelivered_orders=0))
+        session.commit()
+        yield True
+
+    monkeypatch.setattr(online_insertion, "try_warehouse_allocation_lock", allocated_meanwhile)
+
+    assert insert_order_into_route(session, order_id) is None
+    assert session.query(OrdersBigPic.assigned_agent_id).scalar() == other_agent
+    assert session.query(RouteStop).count() == 0
+    assert session.query(AgentsBigPic.no_of_orders).filter(AgentsBigPic.no_of_orders > 0).count() == 0
+    assert session.query(WarehouseOrderCounter.undelivered_orders).scalar() == 0
@@ -0,0 +1,26 @@
+import pytest
+from benchmarks.allocator_benchmark import seed_warehouse
+from benchmarks.datasets import generate_orders
+from warehouse_order_allocation.distances import scratch_buffers
+from warehouse_order_allocation.Order_allocator import OrderAllocator
+
+def test_failed_allocation_releases_scratch_buffers(session, monkeypatch):
+    warehouse = seed_warehouse(session, generate_orders("uniform", 2000), no_of_agents=10)
+    buffered = []
+
+    def kmeans_sectors(self, X, n_sectors):
+        # Constrained k-means fills the distance buffers, the sectors do not
+        labels, _ = self.constrained_kmeans(X, n_sectors)
+        return labels
+
+    def failing_flush(self):
+        buffered.append(scratch_buffers().nbytes)
+        raise RuntimeError("database went away")
+
+    monkeypatch.setattr(OrderAllocator, "assign_points_to_sectors", kmeans_sectors)
+    monkeypatch.setattr(OrderAllocator, "flush_assignments", failing_flush)
+
+    with pytest.raises(RuntimeError):
+        OrderAllocator(session, warehouse).allocate_orders()
+    assert buffered[0] > 0
+    assert scratch_buffers().nbytes == 0
@@ -0,0 +1,83 @@
+import json
+import pytest
+from orders_upload.upload_orders import iter_json_array_rows, iter_ndjson_rows
+
+CHUNK_SIZES = (1, 2, 3, 7, 64, 65536)
+
+class ChunkedStream:
+    def __init__(self, data, chunk_size):
+        """
+        Binary stream returning at most chunk_size bytes per read, to split the body at every
+        possible boundary.
+        """
+        self.data = data
+        self.chunk_size = chunk_size
+        self.pos = 0
+
+    def read(self, size=-1):
+        size = self.chunk_size if size < 0 else min(size, self.chunk_size)
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += len(chunk)
+        return chunk
+
+def parse_array(body, chunk_size):
+    return list(iter_json_array_rows(ChunkedStream(body.encode("utf-8"), chunk_size)))
+
+def parse_ndjson(body, chunk_size):
+    return list(iter_ndjson_rows(ChunkedStream(body.encode("utf-8"), chunk_size)))
+
+ORDERS = [
+    {"warehouse_id": 1, "x_coord": 12.5, "y_coord": -3},
+    {"warehouse_id": 2, "x_coord": 1e3, "y_coord": 0.125, "note": "café ✓"},
+    {"warehouse_id": 10, "x_coord": 123456, "y_coord": 7},
+]
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+@pytest.mark.parametrize("body", [
+    json.dumps(ORDERS, ensure_ascii=False),
+    json.dumps(ORDERS, indent=2, ensure_ascii=False) + "\n",
+    " [ " + " , ".join(json.dumps(order, ensure_ascii=False) for order in ORDERS) + " ] ",
+])
+def test_json_array_rows(body, chunk_size):
+    rows = parse_array(body, chunk_size)
+    assert rows == [({"index": i}, order, None) for i, order in enumerate(ORDERS)]
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+def test_json_array_numbers_split_across_chunks(chunk_size):
+    rows = parse_array("[12345, 6.75e2,-8]", chunk_size)
+    assert [row for _, row, _ in rows] == [12345, 675.0, -8]
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+@pytest.mark.parametrize("body", ["[]", " [ ] ", "[]\n"])
+def test_json_array_empty(body, chunk_size):
+    assert parse_array(body, chunk_size) == []
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+@pytest.mark.parametrize("body", [
+    "",
+    "{}",
+    '[{"a": 1} {"a": 2}]',
+    '[{"a": 1},,{"a": 2}]',
+    '[,{"a": 1}]',
+    '[{"a": 1},]',
+    '[{"a": 1}]garbage',
+    '[{"a": 1}] []',
+    '[{"a": 1}',
+    '[{"a": 1},',
+    '[{"a": }]',
+])
+def test_json_array_malformed(body, chunk_size):
+    with pytest.raises(ValueError):
+        parse_array(body, chunk_size)
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+def test_ndjson_rows_report_line_numbers(chunk_size):
+    body = '{"a": 1}\n\n  \n{"a": 2}\nnot json\n\n{"a": "é"}'
+    rows = parse_ndjson(body, chunk_size)
+    assert [(position, row) for position, row, _ in rows] == [
+        ({"line": 1}, {"a": 1}),
+        ({"line": 4}, {"a": 2}),
+        ({"line": 5}, None),
+        ({"line": 7}, {"a": "é"}),
+    ]
+    assert rows[2][2].startswith("Invalid JSON")
@@ -1,53 +1,108 @@
+import math
+import os
+import time
+from contextlib import contextmanager
 import numpy as np
+from sqlalchemy import update, insert, func
 from sqlalchemy.orm import Session
-from database.models import OrdersBigPic,Warehouse
-import gc
+from database.models import OrdersBigPic,Warehouse,AgentsBigPic,RouteStop
+from database.order_counters import bump_order_counters
+from database.data_version import bump_data_version
+from database.warehouse_lock import warehouse_allocation_lock
+from .spatial_grid import SpatialGrid
+from .route_improvement import improve_route, route_length
+from .minibatch_clustering import KMEANS_MINIBATCH_THRESHOLD, minibatch_constrained_kmeans
+from .distances import DISTANCE_DTYPE, DISTANCE_MEMORY_BUDGET, LazyDistances, block_rows, distances as point_distances, scratch_buffers
+
+ROUTE_IMPROVEMENT_BUDGET = float(os.getenv("ROUTE_IMPROVEMENT_BUDGET", 0))
+
+class AgentState:
+    def __init__(self, agent_id, no_of_orders, total_distance, is_checked_in, location):
+        """
+        In-memory view of an agent's route, kept for the duration of an allocation run.
+
+        Parameters:
+        agent_id (int): ID of the agent.
+        no_of_orders (int): Number of orders (stops) on the route.
+        total_distance (float): Distance travelled along the route.
+        is_checked_in (bool): Whether the agent is checked in.
+        location (tuple): Coordinates (x, y) of the agent's last stop.
+        """
+        self.id = agent_id
+        self.no_of_orders = no_of_orders
+        self.total_distance = total_distance
+        self.is_checked_in = is_checked_in
+        self.location = location
 
 class OrderAllocator:
-    def __init__(self, session, warehouse):
+    def __init__(self, session, warehouse, on_iteration=None, route_time_budget=None):
         """
         Initialize the OrderAllocator with the database session and warehouse object.
 
         Parameters:
         session (Session): SQLAlchemy session.
         warehouse (Warehouse): Warehouse object.
+        on_iteration (function, optional): Called with a progress dict after every allocation iteration.
+        route_time_budget (float, optional): Seconds of 2-opt / Or-opt improvement per route, ROUTE_IMPROVEMENT_BUDGET when omitted; 0 disables it.
         """
         self.session = session
+        self.on_iteration = on_iteration
+        self.route_time_budget = ROUTE_IMPROVEMENT_BUDGET if route_time_budget is None else float(route_time_budget)
+        self.iterations = 0
+        self.phase_seconds = {"load": 0.0, "clustering": 0.0, "tsp": 0.0, "flush": 0.0}
         self.warehouse = warehouse
+        self.warehouse_id = warehouse.id
         self.warehouse_coords = (warehouse.x_coord, warehouse.y_coord)
 
+        # Assignments are buffered here and written back once per iteration
+        self.agents = []
+        self.pending_orders = {}  # order id -> agent id
+        self.pending_stops = []  # Route_stops rows to append
+        self.dirty_agents = {}  # agent id -> AgentState
+
     def allocate_orders(self):
         """
         Allocate orders to agents iteratively using sector-based clustering for the first iteration
         and constrained k-means clustering for subsequent iterations.
 
-        Parameters:
-        session (Session): SQLAlchemy session.
-        warehouse (Warehouse): Warehouse object.
+        Assignments are accumulated in memory and written back with one bulk update for
+        orders and one for agents at the end of every iteration.
+
+        The warehouse's allocation lock is held for the whole run, so allocations of the same
+        warehouse from other threads or processes wait for this one to finish, and the agents
+        are only loaded once it is held.
 
         Returns:
-        None
+        int: Total number of orders allocated.
         """
-        warehouse_coords = self.warehouse_coords
+        with warehouse_allocation_lock(self.session, self.warehouse_id):
+            try:
+                return self._allocate_orders()
+            finally:
+                # The scratch buffers are sized for this warehouse, do not hold on to them
+                # between runs, failed ones included, as the calling thread may live on
+                scratch_buffers().clear()
+
+    def _allocate_orders(self):
+        with self.timed_phase("load"):
+            self.load_agents()
+        total_allocated = 0
         i = 0
         while True:
             # Get undelivered orders
-            orders = [
-                (order.id, order.x_coord, order.y_coord)
-                for order in self.warehouse.orders
-                if not order.is_delivered
-            ]
+            with self.timed_phase("load"):
+                orders = self.load_undelivered_orders()
             print(f"No of undelivered orders {len(orders)}")
-            n_undelivered_orders_before_allocation = len(orders)
             if len(orders) == 0:
                 print("No undelivered orders remaining!")
                 break
 
-            orders = np.array(orders)
+            # Plain tuples, numpy probes every Row object for the array protocols otherwise
+            orders = np.array([tuple(order) for order in orders], dtype=float)
             order_ids = orders[:, 0].astype(int)
             order_coords = orders[:, 1:3].astype(float)
 
-            available_agents = [agent for agent in self.warehouse.agents if agent.no_of_orders < 60 and agent.total_distance < 95 and agent.is_checked_in] # max distance limit might be 100 but since the area within warehouse limits is 80km2 we have to adjust the theshold to take the available agents
+            available_agents = [agent for agent in self.agents if agent.no_of_orders < 60 and agent.total_distance < 95 and agent.is_checked_in] # max distance limit might be 100 but since the area within warehouse limits is 80km2 we have to adjust the theshold to take the available agents
             n_available_agents = len(available_agents)
             print(f"Agents available {n_available_agents}")
             if n_available_agents == 0:
@@ -56,156 +111,202 @@ class OrderAllocator:
 
             if len(orders) < n_available_agents:
                 print("Number of orders is less than the number of available agents so switching to round robin!")
-                available_agents = [agent for agent in self.warehouse.agents if agent.no_of_orders < 60 and agent.total_distance < 100]
-                allocated_count = self.round_robin_allocation(orders.tolist(), available_agents)
+                available_agents = [agent for agent in self.agents if agent.no_of_orders < 60 and agent.total_distance < 100]
+                with self.timed_phase("tsp"):
+                    allocated_count = self.round_robin_allocation(orders.tolist(), available_agents)
+                total_allocated += self.end_iteration(len(orders), len(available_agents))
                 print(f"Orders allocated with round robin {allocated_count}")
                 break
 
-            if i == 0:
-                i+=1
-                # Perform sector-based clustering for the first iteration
-                print("Performing sector-based clustering for the first iteration.")
-                sector_assignments = self.assign_points_to_sectors(order_coords, n_available_agents)
-                sector_based_clusters = [[] for _ in range(n_available_agents)]
-                for idx, sector in enumerate(sector_assignments):
-                    sector_based_clusters[sector].append(idx)
-
-                allocated_count = 0  # Track the number of orders allocated in this iteration
-
-                for cluster_id, agent in enumerate(available_agents):
-                    self.session.refresh(agent)
-
-                    cluster_indices = sector_based_clusters[cluster_id]
-                    cluster_orders = order_coords[cluster_indices]
-                    cluster_order_ids = order_ids[cluster_indices]
-
-                    if agent.orders is None:
-                        agent.orders = []
-
-                    if len(cluster_orders) > 1:
-        
-                        distance_matrix = self.compute_distance_matrix(cluster_orders)
-                        self.greedy_tsp_with_agent(distance_matrix, agent, cluster_orders, cluster_order_ids)
-                        allocated_count += self.session.query(OrdersBigPic).filter(
-                            OrdersBigPic.id.in_(cluster_order_ids.tolist()),  # Convert to list of ints
-                            OrdersBigPic.is_delivered == True
-                        ).count()
-                        
-                        del distance_matrix
-                        gc.collect()
-
-                    elif len(cluster_orders) == 1:
-                        single_order_id = int(cluster_order_ids[0])
-                        single_order_coords = tuple(cluster_orders[0])
-                        current_orders = list(agent.orders) if agent.orders else []
-
-                        if(len(current_orders)):
-                            last_delivered_order = current_orders[-1]
-                            last_order_coords = self.session.query(OrdersBigPic.x_coord,OrdersBigPic.y_coord).filter(OrdersBigPic.id == last_delivered_order).first()
-                        else:
-                            last_order_coords = self.warehouse_coords
-
-                        distance_to_add = np.linalg.norm(np.array(last_order_coords) - np.array(single_order_coords))
-
-                        if agent.no_of_orders < 60 and agent.total_distance + distance_to_add < 100:
-                            current_orders.append(single_order_id)
-                            agent.no_of_orders += 1
-                            agent.total_distance += distance_to_add
-                            agent.total_distance = float(agent.total_distance)
-                            agent.orders = current_orders
-
-                            order = self.session.query(OrdersBigPic).filter(OrdersBigPic.id == single_order_id).first()
-                            order.is_delivered = True
-                            order.assigned_agent_id = agent.id
-                            allocated_count += 1
+            allocated_count = 0  # Track the number of orders allocated in this iteration
 
-            else:
-                # Perform constrained k-means clustering
-                clusters, centroids = self.constrained_kmeans(order_coords, n_available_agents)
-
-                # Assign clusters to agents based on the nearest centroid to their last known location
-                agent_to_centroid_mapping = []
-                for agent in available_agents:
-                    self.session.refresh(agent)
-                    if agent.orders:
-                        last_order_id = int(agent.orders[-1])
-                        last_order = self.session.query(OrdersBigPic).filter(OrdersBigPic.id == last_order_id).first()
-                        agent_coords = [last_order.x_coord, last_order.y_coord]
-                    else:
-                        agent_coords = warehouse_coords
-
-                    distances_to_centroids = np.linalg.norm(centroids - np.array(agent_coords), axis=1)
-                    closest_centroid = np.argmin(distances_to_centroids)
-                    agent_to_centroid_mapping.append((agent, closest_centroid))
+            with self.timed_phase("clustering"):
+                if i == 0:
+                    i+=1
+                    # Perform sector-based clustering for the first iteration
+                    print("Performing sector-based clustering for the first iteration.")
+                    clusters = self.assign_points_to_sectors(order_coords, n_available_agents)
+                    agent_to_cluster = {agent: cluster_id for cluster_id, agent in enumerate(available_agents)}
 
-                # Ensure each centroid is assigned to one agent
-                assigned_centroids = set()
-                agent_to_cluster = {}
-                for agent, centroid_idx in sorted(agent_to_centroid_mapping, key=lambda x: x[1]):
-                    if centroid_idx not in assigned_centroids:
-                        agent_to_cluster[agent] = centroid_idx
-                        assigned_centroids.add(centroid_idx)
+                else:
+                    # Perform constrained k-means clustering
+                    clusters, centroids = self.constrained_kmeans(order_coords, n_available_agents)
+
+                    # Assign clusters to agents based on the nearest centroid to their last known location
+                    agent_to_centroid_mapping = []
+                    for agent in available_agents:
+                        distances_to_centroids = np.linalg.norm(centroids - np.array(agent.location), axis=1)
+                        closest_centroid = np.argmin(distances_to_centroids)
+                        agent_to_centroid_mapping.append((agent, closest_centroid))
+
+                    # Ensure each centroid is assigned to one agent
+                    assigned_centroids = set()
+                    agent_to_cluster = {}
+                    for agent, centroid_idx in sorted(agent_to_centroid_mapping, key=lambda x: x[1]):
+                        if centroid_idx not in assigned_centroids:
+                            agent_to_cluster[agent] = centroid_idx
+                            assigned_centroids.add(centroid_idx)
+
+            with self.timed_phase("tsp"):
+                # One spatial index over this iteration's orders is shared by every cluster
+                grid = SpatialGrid(order_coords, clusters)
 
                 # Allocate orders within clusters to assigned agents
-                allocated_count = 0
                 for agent, cluster_idx in agent_to_cluster.items():
-                    self.session.refresh(agent)
-
-                    cluster_indices = np.where(clusters == cluster_idx)[0]
-                    cluster_orders = order_coords[cluster_indices]
-                    cluster_order_ids = order_ids[cluster_indices]
-
-                    if len(cluster_orders) > 1:
-                        distance_matrix = self.compute_distance_matrix(cluster_orders)
-                        self.greedy_tsp_with_agent(distance_matrix, agent, cluster_orders, cluster_order_ids)
-                        allocated_count += self.session.query(OrdersBigPic).filter(
-                            OrdersBigPic.id.in_(cluster_order_ids.tolist()),
-                            OrdersBigPic.is_delivered == True
-                        ).count()
-                        del distance_matrix
-                        gc.collect()
-                    elif len(cluster_orders) == 1:
-                        single_order_id = int(cluster_order_ids[0])
-                        single_order_coords = tuple(cluster_orders[0])
-                        current_orders = list(agent.orders) if agent.orders else []
-
-                        if len(current_orders):
-                            last_delivered_order = current_orders[-1]
-                            last_order_coords = self.session.query(OrdersBigPic.x_coord, OrdersBigPic.y_coord).filter(OrdersBigPic.id == last_delivered_order).first()
-                        else:
-                            last_order_coords = warehouse_coords
-
-                        distance_to_add = np.linalg.norm(np.array(last_order_coords) - np.array(single_order_coords))
-
-                        if agent.no_of_orders < 60 and agent.total_distance + distance_to_add < 100:
-                            current_orders.append(single_order_id)
-                            agent.no_of_orders += 1
-                            agent.total_distance += distance_to_add
-                            agent.total_distance = float(agent.total_distance)
-                            agent.orders = current_orders
-
-                            order = self.session.query(OrdersBigPic).filter(OrdersBigPic.id == single_order_id).first()
-                            order.is_delivered = True
-                            order.assigned_agent_id = agent.id
-                            allocated_count += 1
-            
-            self.session.commit()
-
-            undelivered_orders_after_allocation = [
-                (order.id, order.x_coord, order.y_coord)
-                for order in self.warehouse.orders
-                if not order.is_delivered
-            ]
-            n_undelivered_orders_after_allocation = len(undelivered_orders_after_allocation) 
-            if n_undelivered_orders_before_allocation == n_undelivered_orders_after_allocation:
+                    allocated_count += self.greedy_tsp_with_agent(grid, agent, cluster_idx, order_ids)
+
+            total_allocated += self.end_iteration(len(orders), n_available_agents)
+
+            if allocated_count == 0:
                 print("No orders were allocated in this iteration. Exiting loop.")
                 break
 
-            
             print("Iteration complete. Re-clustering remaining orders.")
 
         print("Order allocation fully complete.")
-        return
+        return total_allocated
+
+    @contextmanager
+    def timed_phase(self, phase):
+        """
+        Add the wall time spent in the with block to phase_seconds[phase].
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_seconds[phase] += time.perf_counter() - start
+
+    def load_agents(self):
+        """
+        Load the warehouse's agents into memory together with their last known position.
+
+        Returns:
+        list: AgentState objects ordered by agent ID.
+        """
+        rows = self.session.query(
+            AgentsBigPic.id,
+            AgentsBigPic.no_of_orders,
+            AgentsBigPic.total_distance,
+            AgentsBigPic.is_checked_in,
+            AgentsBigPic.last_x,
+            AgentsBigPic.last_y,
+        ).filter(AgentsBigPic.warehouse_id == self.warehouse_id).order_by(AgentsBigPic.id).all()
+
+        self.agents = []
+        for row in rows:
+            # Agents without a recorded position have not left the warehouse yet
+            location = (row.last_x, row.last_y) if row.last_x is not None and row.last_y is not None else self.warehouse_coords
+            self.agents.append(AgentState(
+                row.id, row.no_of_orders, float(row.total_distance), row.is_checked_in, location
+            ))
+        return self.agents
+
+    def load_undelivered_orders(self):
+        """
+        Fetch the warehouse's undelivered orders.
+
+        Returns:
+        list: Tuples (id, x_coord, y_coord) ordered by order ID.
+        """
+        return self.session.query(
+            OrdersBigPic.id, OrdersBigPic.x_coord, OrdersBigPic.y_coord
+        ).filter(
+            OrdersBigPic.warehouse_id == self.warehouse_id,
+            OrdersBigPic.is_delivered == False,
+        ).order_by(OrdersBigPic.id).all()
+
+    def assign_order(self, agent, order_id, order_coords, distance_to_add):
+        """
+        Append an order to an agent's route and buffer the assignment for the next flush.
+
+        Parameters:
+        agent (AgentState): Agent receiving the order.
+        order_id (int): ID of the order.
+        order_coords (tuple): Coordinates (x, y) of the order.
+        distance_to_add (float): Distance from the agent's last stop to the order.
+
+        Returns:
+        None
+        """
+        self.pending_stops.append({
+            "agent_id": agent.id,
+            "seq": agent.no_of_orders,
+            "order_id": int(order_id),
+            "leg_distance": float(distance_to_add),
+        })
+        agent.no_of_orders += 1
+        agent.total_distance = float(agent.total_distance + distance_to_add)
+        agent.location = (float(order_coords[0]), float(order_coords[1]))
+
+        self.pending_orders[int(order_id)] = agent.id
+        self.dirty_agents[agent.id] = agent
+
+    def end_iteration(self, n_undelivered_orders, n_available_agents):
+        """
+        Flush the iteration's assignments and report progress to the on_iteration callback.
+
+        Parameters:
+        n_undelivered_orders (int): Undelivered orders at the start of the iteration.
+        n_available_agents (int): Agents the iteration allocated to.
+
+        Returns:
+        int: Number of orders allocated in the iteration.
+        """
+        with self.timed_phase("flush"):
+            allocated = self.flush_assignments()
+        self.iterations += 1
+        if self.on_iteration is not None:
+            self.on_iteration({
+                "warehouse_id": self.warehouse_id,
+                "iteration": self.iterations,
+                "undelivered_orders": n_undelivered_orders,
+                "agents_available": n_available_agents,
+                "orders_allocated": allocated,
+            })
+        return allocated
+
+    def flush_assignments(self):
+        """
+        Write buffered assignments back with one bulk update for orders, one bulk insert of
+        route stops and one bulk update for agents, then commit.
+
+        Returns:
+        int: Number of order assignments written.
+        """
+        n_orders = len(self.pending_orders)
+        if self.pending_orders:
+            self.session.execute(update(OrdersBigPic), [
+                {"id": order_id, "is_delivered": True, "assigned_agent_id": agent_id}
+                for order_id, agent_id in self.pending_orders.items()
+            ])
+        if self.pending_stops:
+            self.session.execute(insert(RouteStop.__table__), self.pending_stops)
+        bump_order_counters(self.session, {self.warehouse_id: -n_orders})
+        if self.dirty_agents:
+            self.session.execute(update(AgentsBigPic), [
+                {
+                    "id": agent.id,
+                    "no_of_orders": agent.no_of_orders,
+                    "total_distance": agent.total_distance,
+                    "last_x": agent.location[0],
+                    "last_y": agent.location[1],
+                }
+                for agent in self.dirty_agents.values()
+            ])
+            # Tells cached copies of these routes (see online_insertion) that they changed
+            self.session.execute(
+                update(AgentsBigPic).where(AgentsBigPic.id.in_(list(self.dirty_agents))).values(
+                    route_version=func.coalesce(AgentsBigPic.route_version, 0) + 1
+                )
+            )
+        bump_data_version(self.session)
+        self.session.commit()
+
+        self.pending_orders = {}
+        self.pending_stops = []
+        self.dirty_agents = {}
+        return n_orders
 
 
     def round_robin_allocation(self, undelivered_orders, agents, max_orders_per_agent=60, max_distance_per_agent=100):
@@ -213,9 +314,8 @@ class OrderAllocator:
         Allocate orders to agents using a round-robin approach.
 
         Parameters:
-        session (Session): SQLAlchemy session.
         undelivered_orders (list): List of undelivered orders as tuples (id, x_coord, y_coord).
-        agents (list): List of available agents.
+        agents (list): List of available agents (AgentState).
         max_orders_per_agent (int): Maximum number of orders an agent can take.
         max_distance_per_agent (float): Maximum total distance an agent can travel.
 
@@ -240,23 +340,10 @@ class OrderAllocator:
 
             while not assigned:
                 if len(exhausted_agents) == len(agents):
-                    self.session.commit()
                     return allocated_count
 
                 agent = next(agent_cycle)
-                self.session.refresh(agent)
-
-                if agent.no_of_orders > 0:
-                    last_order_id = agent.orders[-1]
-                    last_order_coords = self.session.query(OrdersBigPic.x_coord, OrdersBigPic.y_coord).filter(OrdersBigPic.id == last_order_id).first()
-                    if not last_order_coords:
-                        continue
-                    distance_to_add = np.linalg.norm(np.array([order_x, order_y]) - np.array(last_order_coords))
-                else:
-                    warehouse_coords = self.warehouse_coords
-                    if not warehouse_coords:
-                        continue
-                    distance_to_add = np.linalg.norm(np.array([order_x, order_y]) - np.array(warehouse_coords))
+                distance_to_add = np.linalg.norm(np.array([order_x, order_y]) - np.array(agent.location))
 
                 if agent.total_distance + distance_to_add > max_distance_per_agent:
                     failed_agents += 1
@@ -264,18 +351,7 @@ class OrderAllocator:
                         break
                     continue
 
-                order = self.session.query(OrdersBigPic).filter(OrdersBigPic.id == order_id).first()
-                order.is_delivered = True
-                order.assigned_agent_id = agent.id
-                
-                current_orders = list(agent.orders) if agent.orders else []
-                agent.no_of_orders += 1
-                agent.total_distance += distance_to_add
-                agent.total_distance = float(agent.total_distance)
-                current_orders.append(order_id)
-                agent.orders = current_orders
-
-                self.session.commit()
+                self.assign_order(agent, int(order_id), (order_x, order_y), distance_to_add)
 
                 if agent.no_of_orders >= max_orders_per_agent or agent.total_distance >= max_distance_per_agent:
                     exhausted_agents.add(agent)
@@ -283,127 +359,99 @@ class OrderAllocator:
                 allocated_count += 1
                 assigned = True
 
-        self.session.commit()  # Commit remaining changes
         return allocated_count
 
 
-    def greedy_tsp_with_agent(self,distance_matrix, agent, cluster_orders, cluster_order_ids, max_distance=100, max_orders=60):
+    def greedy_tsp_with_agent(self, grid, agent, cluster_idx, order_ids, max_distance=100, max_orders=60):
         """
-        Solve a simplified TSP using a greedy algorithm.
+        Solve a simplified TSP using a greedy nearest-neighbour walk over a spatial index.
+
+        The walk starts at the agent's last known location and repeatedly moves to the
+        closest order of the cluster still in the index, removing every visited order.
+        When a route time budget is set, the walk is then shortened with improve_route and
+        the distance saved is spent on further orders of the cluster.
 
         Parameters:
-        distance_matrix (np.ndarray): Distance matrix.
-        agent (AgentsBigPic): Agent object.
-        cluster_orders (np.ndarray): Order coordinates.
-        cluster_order_ids (np.ndarray): Order IDs.
-        session (Session): SQLAlchemy session.
+        grid (SpatialGrid): Spatial index over the iteration's order coordinates, labelled by cluster.
+        agent (AgentState): Agent state.
+        cluster_idx (int): Label of the cluster assigned to the agent.
+        order_ids (np.ndarray): Order IDs, aligned with the points of the grid.
         max_distance (float): Maximum allowable distance.
         max_orders (int): Maximum number of orders.
 
         Returns:
-        None
+        int: Number of orders assigned to the agent.
         """
-        n_points = distance_matrix.shape[0]
-        current_orders = list(agent.orders) if agent.orders else []
-
-        # Determine agent's last location
-        if agent.orders:
-            last_order_id = agent.orders[-1]
-            last_location = self.session.query(OrdersBigPic.x_coord, OrdersBigPic.y_coord).filter(
-                OrdersBigPic.id == last_order_id
-            ).first()
-        else:
-            last_location = self.warehouse_coords
-
-        # Find starting point
-        start_point = OrderAllocator.find_closest_point(last_location, cluster_orders)
-        distance_to_add = distance_matrix[start_point].min()
-        if agent.total_distance + distance_to_add > max_distance:
-            return  # Exit early if initial point breaches threshold
-
-        # Initialize visited array and route
-        visited = np.zeros(n_points, dtype=bool)
-        route = [start_point]
-        visited[start_point] = True
-
-        # Update agent and order for the starting point
-        order_id = int(cluster_order_ids[start_point])
-        current_orders.append(order_id)
-        agent.no_of_orders += 1
-        agent.total_distance += distance_to_add
-        agent.total_distance = float(agent.total_distance)
-        order = self.session.query(OrdersBigPic).filter(OrdersBigPic.id == order_id).first()
-        order.is_delivered = True
-        order.assigned_agent_id = agent.id
-        current_point = start_point
-
-        # Iterate over remaining points
-        for _ in range(n_points - 1):
-            if agent.no_of_orders >= max_orders:
-                break
+        start = agent.location
+        max_stops = max_orders - agent.no_of_orders
+        distance_left = max_distance - agent.total_distance
+        route, length = self.extend_route(grid, cluster_idx, start, [], 0.0, max_stops, distance_left)
 
-            # Find the closest unvisited point
-            distances = distance_matrix[current_point]
-            mask = np.where(visited, np.inf, 0)
-            closest_point = np.argmin(distances + mask)
-            distance_to_add = distances[closest_point]
+        if self.route_time_budget > 0 and len(route) > 2:
+            deadline = time.perf_counter() + self.route_time_budget
+            while True:
+                order = improve_route(start, grid.points[route], deadline)
+                route = [route[k] for k in order]
+                length = route_length(start, grid.points[route])
 
-            if agent.total_distance + distance_to_add > max_distance:
-                break  # Stop if adding the point breaches the distance limit
+                n_stops = len(route)
+                route, length = self.extend_route(grid, cluster_idx, start, route, length, max_stops, distance_left)
+                if len(route) == n_stops or time.perf_counter() >= deadline:
+                    break
 
-            # Update agent and order for the selected point
-            route.append(closest_point)
-            visited[closest_point] = True
-            order_id = int(cluster_order_ids[closest_point])
-            current_orders.append(order_id)
-            agent.no_of_orders += 1
-            agent.total_distance += distance_to_add
-            agent.total_distance = float(agent.total_distance)
-            order = self.session.query(OrdersBigPic).filter(OrdersBigPic.id == order_id).first()
-            order.is_delivered = True
-            order.assigned_agent_id = agent.id
-            current_point = closest_point
-
-        agent.orders = current_orders
-        self.session.commit()
-        del distance_matrix
-        gc.collect()
+        location = start
+        for closest_point in route:
+            point = grid.points[closest_point]
+            distance_to_add = math.hypot(point[0] - location[0], point[1] - location[1])
+            self.assign_order(agent, order_ids[closest_point], point, distance_to_add)
+            location = agent.location
+
+        return len(route)
 
     @staticmethod
-    def find_closest_point(last_location, cluster_orders):
+    def extend_route(grid, cluster_idx, start, route, length, max_stops, distance_left):
         """
-        Find the index of the point in cluster_orders closest to the given last location.
+        Append the closest remaining orders of a cluster to the end of a route while the
+        stop and distance limits allow, removing them from the index.
 
         Parameters:
-        last_location (tuple): Last known location (x, y).
-        cluster_orders (list): List of order coordinates (x, y).
+        grid (SpatialGrid): Spatial index over the iteration's order coordinates, labelled by cluster.
+        cluster_idx (int): Label of the cluster to take orders from.
+        start (tuple): Coordinates (x, y) the route starts from.
+        route (list): Grid indices of the route's stops so far.
+        length (float): Length of the route so far.
+        max_stops (int): Maximum number of stops on the route.
+        distance_left (float): Maximum length of the route.
 
         Returns:
-        int: Index of the closest point.
+        tuple: The extended route and its length.
         """
-        points = np.array(cluster_orders)
-        distances = np.linalg.norm(points - np.array(last_location), axis=1)
-        return np.argmin(distances)
+        route = list(route)
+        location = grid.points[route[-1]] if route else start
+        while len(route) < max_stops:
+            closest_point, distance_to_add = grid.nearest(location, cluster_idx)
+            if closest_point is None:
+                break
 
-    @staticmethod
-    def compute_distance_matrix(points):
-        """
-        Compute the pairwise Euclidean distance matrix for a set of points.
+            if length + distance_to_add > distance_left:
+                break  # Stop if adding the point breaches the distance limit
 
-        Parameters:
-        points (np.ndarray): Array of points.
+            grid.remove(closest_point)
+            route.append(closest_point)
+            length += distance_to_add
+            location = grid.points[closest_point]
+
+        return route, length
 
-        Returns:
-        np.ndarray: Pairwise distance matrix.
-        """
-        sq_diff = np.sum(points**2, axis=1)[:, np.newaxis] + np.sum(points**2, axis=1) - 2 * np.dot(points, points.T)
-        return np.sqrt(np.maximum(sq_diff, 0))
-    
     @staticmethod
     def constrained_kmeans(X, n_clusters, centroids=None, max_iters=10, tol=1e-4):
         """
         Perform k-means clustering with constraints on the number of points per cluster.
 
+        Every cluster receives n_samples // n_clusters points, and the remaining
+        n_samples % n_clusters points are spread one per cluster, so cluster sizes
+        differ by at most one.
+
         Parameters:
         X (np.ndarray): Input data points.
         n_clusters (int): Number of clusters.
@@ -413,40 +461,54 @@ class OrderAllocator:
 
         Returns:
         np.ndarray: Cluster labels for each point.
+        np.ndarray: Final centroids.
         """
         np.random.seed(42)
         n_samples = X.shape[0]
         points_per_cluster = n_samples // n_clusters
-        extra_points = n_samples % n_clusters
+
+        if KMEANS_MINIBATCH_THRESHOLD and n_samples > KMEANS_MINIBATCH_THRESHOLD:
+            if centroids is None:
+                # Seeding from a sample is enough to spread the centroids over the area
+                sample = X[np.random.choice(n_samples, size=min(n_samples, max(10000, 10 * n_clusters)), replace=False)]
+                centroids = OrderAllocator.kmeans_plus_plus_initialization(sample, n_clusters)
+            return minibatch_constrained_kmeans(X, n_clusters, centroids)
 
         if centroids is None:
             centroids = OrderAllocator.kmeans_plus_plus_initialization(X, n_clusters)
 
+        # The full matrix is only kept when it fits the memory budget, otherwise the assignment
+        # computes the distances it needs a block of rows at a time
+        full_matrix = n_samples * n_clusters * DISTANCE_DTYPE.itemsize <= DISTANCE_MEMORY_BUDGET
+        if full_matrix:
+            # One buffer holds every iteration's distances, and is reused by the next clusterings
+            matrix = scratch_buffers().get("centroid_distances", (n_samples, n_clusters), DISTANCE_DTYPE)
         for _ in range(max_iters):
-            distances = np.linalg.norm(X[:, np.newaxis] - centroids, axis=2)
-            sorted_indices = np.argsort(distances, axis=1)
-
-            cluster_counts = np.zeros(n_clusters, dtype=int)
-            labels = -1 * np.ones(n_samples, dtype=int)
-
-            for i in range(n_samples):
-                for cluster_idx in sorted_indices[i]:
-                    if cluster_counts[cluster_idx] < points_per_cluster:
-                        labels[i] = cluster_idx
-                        cluster_counts[cluster_idx] += 1
-                        break
-
-            if extra_points > 0:
-                unassigned_points = np.where(labels == -1)[0]
-                for point_idx in unassigned_points:
-                    closest_cluster = np.argmin(distances[point_idx])
-                    labels[point_idx] = closest_cluster
-                    cluster_counts[closest_cluster] += 1
-
-            new_centroids = np.array([
-                X[labels == i].mean(axis=0) if np.any(labels == i) else centroids[i]
-                for i in range(n_clusters)
-            ])
+            if full_matrix:
+                distances = point_distances(X, centroids, out=matrix)
+            else:
+                distances = LazyDistances(X, centroids)
+
+            capacities = np.full(n_clusters, points_per_cluster, dtype=int)
+            labels = OrderAllocator.balanced_assignment(distances, capacities)
+
+            # Spread the leftover points, at most one extra per cluster. There are fewer of
+            # them than clusters, so their rows are small enough to copy.
+            unassigned_points = np.where(labels == -1)[0]
+            if len(unassigned_points) > 0:
+                extra_labels = OrderAllocator.balanced_assignment(
+                    matrix[unassigned_points] if full_matrix else LazyDistances(X[unassigned_points], centroids),
+                    np.ones(n_clusters, dtype=int),
+                )
+                labels[unassigned_points] = extra_labels
+
+            cluster_counts = np.bincount(labels, minlength=n_clusters)
+            sums_x = np.bincount(labels, weights=X[:, 0], minlength=n_clusters)
+            sums_y = np.bincount(labels, weights=X[:, 1], minlength=n_clusters)
+            non_empty = cluster_counts > 0
+            new_centroids = centroids.astype(float)
+            new_centroids[non_empty, 0] = sums_x[non_empty] / cluster_counts[non_empty]
+            new_centroids[non_empty, 1] = sums_y[non_empty] / cluster_counts[non_empty]
 
             if np.linalg.norm(centroids - new_centroids) < tol:
                 break
@@ -455,6 +517,89 @@ class OrderAllocator:
 
         return labels,centroids
 
+    @staticmethod
+    def balanced_assignment(distances, capacities, budget=DISTANCE_MEMORY_BUDGET):
+        """
+        Assign points to clusters without exceeding each cluster's capacity.
+
+        Works in batched rounds: every unassigned point bids for its nearest cluster that
+        still has room, and each cluster accepts the bids with the highest regret (the
+        extra distance the point would travel to its second choice) up to its remaining
+        capacity. Clusters that fill up are closed for the following rounds, so the loop
+        runs at most n_clusters + 1 times.
+
+        Each round reads the distances of the unassigned points to the open clusters a block
+        of rows at a time, gathered into reused buffers, so its memory stays within the budget
+        whatever the number of points and clusters.
+
+        Parameters:
+        distances (np.ndarray or LazyDistances): Point to centroid distances of shape (n_samples, n_clusters).
+        capacities (np.ndarray): Maximum number of points each cluster can take.
+        budget (int): Memory budget of the distance blocks in bytes.
+
+        Returns:
+        np.ndarray: Cluster label for each point, -1 for points left unassigned once every cluster is full.
+        """
+        n_samples, n_clusters = distances.shape
+        labels = -1 * np.ones(n_samples, dtype=int)
+        remaining = np.array(capacities, dtype=int)
+        unassigned = np.arange(n_samples)
+        scratch = scratch_buffers()
+        is_matrix = isinstance(distances, np.ndarray)
+
+        while len(unassigned) > 0 and np.any(remaining > 0):
+            open_clusters = np.where(remaining > 0)[0]
+            all_open = len(open_clusters) == n_clusters
+            best = np.empty(len(unassigned), dtype=int)
+            best_distance = np.empty(len(unassigned))
+            regret = np.zeros(len(unassigned))
+
+            block_size = block_rows(n_clusters + len(open_clusters), distances.dtype, budget)
+            for start in range(0, len(unassigned), block_size):
+                stop = min(start + block_size, len(unassigned))
+                points = unassigned[start:stop]
+                if is_matrix and all_open and len(unassigned) == n_samples:
+                    # Nothing to leave out yet, so the matrix is read in place
+                    block = distances[start:stop]
+                else:
+                    block = scratch.get("assignment_block", (stop - start, len(open_clusters)), distances.dtype)
+                    if not is_matrix:
+                        distances.take(points, open_clusters, block)
+                    elif all_open:
+                        np.take(distances, points, axis=0, out=block)
+                    else:
+                        point_rows = scratch.get("assignment_rows", (stop - start, n_clusters), distances.dtype)
+                        np.take(distances, points, axis=0, out=point_rows)
+                        np.take(point_rows, open_clusters, axis=1, out=block)
+
+                rows = np.arange(stop - start)
+                block_best = np.argmin(block, axis=1)
+                block_best_distance = block[rows, block_best]
+                if len(open_clusters) > 1:
+                    # Hide the best entries to find the second best, then put them back
+                    block[rows, block_best] = np.inf
+                    regret[start:stop] = block.min(axis=1) - block_best_distance
+                    block[rows, block_best] = block_best_distance
+                best[start:stop] = block_best
+                best_distance[start:stop] = block_best_distance
+            bids = open_clusters[best]
+
+            # Rank the bids within each cluster, highest regret first and closest point on ties
+            order = np.lexsort((best_distance, -regret, bids))
+            sorted_bids = bids[order]
+            group_starts = np.searchsorted(sorted_bids, sorted_bids, side="left")
+            rank = np.arange(len(order)) - group_starts
+
+            accepted = order[rank < remaining[sorted_bids]]
+            labels[unassigned[accepted]] = bids[accepted]
+            remaining -= np.bincount(bids[accepted], minlength=n_clusters)
+
+            still_unassigned = np.ones(len(unassigned), dtype=bool)
+            still_unassigned[accepted] = False
+            unassigned = unassigned[still_unassigned]
+
+        return labels
+
     def assign_points_to_sectors(self,X, n_sectors):
         """
         Assign points to angular sectors around a warehouse.
@@ -480,10 +625,32 @@ class OrderAllocator:
     
     @staticmethod
     def kmeans_plus_plus_initialization(X, n_clusters):
-        centroids = [X[np.random.choice(range(X.shape[0]))]]
-        for _ in range(1, n_clusters):
-            distances = np.min([np.linalg.norm(X - c, axis=1)**2 for c in centroids], axis=0)
-            probabilities = distances / distances.sum()
-            new_centroid = X[np.random.choice(range(X.shape[0]), p=probabilities)]
-            centroids.append(new_centroid)
-        return np.array(centroids)
+        """
+        Pick initial centroids with k-means++ seeding.
+
+        Each point's squared distance to its nearest chosen centroid is kept and only
+        compared with the newest centroid, so seeding takes O(n_samples * n_clusters).
+
+        Parameters:
+        X (np.ndarray): Array of shape (n_samples, 2) with the points.
+        n_clusters (int): Number of centroids to pick.
+
+        Returns:
+        np.ndarray: Array of shape (n_clusters, 2) with the initial centroids.
+        """
+        n_samples = X.shape[0]
+        centroids = np.empty((n_clusters, X.shape[1]))
+        centroids[0] = X[np.random.randint(n_samples)]
+        min_distances = np.sum((X - centroids[0]) ** 2, axis=1)
+
+        for i in range(1, n_clusters):
+            # Draw a point with probability proportional to its squared distance
+            cumulative = np.cumsum(min_distances)
+            if cumulative[-1] > 0:
+                index = min(np.searchsorted(cumulative, np.random.random() * cumulative[-1], side="right"), n_samples - 1)
+            else:
+                index = np.random.randint(n_samples)
+            centroids[i] = X[index]
+            np.minimum(min_distances, np.sum((X - centroids[i]) ** 2, axis=1), out=min_distances)
+
+        return centroids
@@ -0,0 +1,154 @@
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from database.models import AllocationJob, Warehouse
+from .parallel_allocation import allocate_warehouse, allocate_warehouses_parallel
+
+_job_queue = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+def submit_allocation_job(get_db, warehouse_id=None, parallel=False, workers=None):
+    """
+    Persist an allocation job and queue it for the background worker.
+
+    Parameters:
+    get_db (function): Function to provide a database session.
+    warehouse_id (int, optional): Warehouse to allocate, every warehouse when omitted.
+    parallel (bool): Allocate every warehouse concurrently in a process pool.
+    workers (int, optional): Size of the process pool in parallel mode.
+
+    Returns:
+    int: ID of the queued job.
+    """
+    with get_db() as db:
+        job = AllocationJob(
+            status="queued", warehouse_id=warehouse_id, parallel=parallel, workers=workers,
+            worker_pid=os.getpid(), progress=[],
+        )
+        db.add(job)
+        db.commit()
+        job_id = job.id
+
+    _ensure_worker(get_db)
+    _job_queue.put(job_id)
+    return job_id
+
+def get_allocation_job(db, job_id):
+    """
+    Fetch a job and convert it to a JSON serialisable dict.
+
+    Parameters:
+    db (Session): SQLAlchemy session.
+    job_id (int): ID of the job.
+
+    Returns:
+    dict: Job state, progress and result, or None if the job does not exist.
+    """
+    job = db.query(AllocationJob).filter(AllocationJob.id == job_id).first()
+    if not job:
+        return None
+    return {
+        "id": job.id,
+        "status": job.status,
+        "warehouse_id": job.warehouse_id,
+        "parallel": job.parallel,
+        "progress": job.progress or [],
+        "result": job.result,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+def recover_interrupted_jobs(get_db, worker_pid=None):
+    """
+    Mark jobs left queued or running by a previous server process as failed.
+
+    Parameters:
+    get_db (function): Function to provide a database session.
+    worker_pid (int, optional): Only fail the jobs of this server process, used when a prefork
+        worker dies while the others keep running. Every unfinished job when omitted.
+
+    Returns:
+    int: Number of jobs marked as failed.
+    """
+    with get_db() as db:
+        query = db.query(AllocationJob).filter(AllocationJob.status.in_(["queued", "running"]))
+        if worker_pid is None:
+            error = "Interrupted by a server restart"
+        else:
+            query = query.filter(AllocationJob.worker_pid == worker_pid)
+            error = f"Interrupted by the exit of server worker {worker_pid}"
+        count = query.update(
+            {AllocationJob.status: "failed", AllocationJob.error: error, AllocationJob.finished_at: datetime.utcnow()},
+            synchronize_session=False
+        )
+        db.commit()
+    return count
+
+def _ensure_worker(get_db):
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_worker_loop, args=(get_db,), name="allocation-worker", daemon=True)
+            _worker.start()
+
+def _worker_loop(get_db):
+    # Jobs of this process run one at a time. Allocations started elsewhere (synchronous
+    # requests, other prefork workers) are kept off the same warehouse by its allocation lock.
+    while True:
+        job_id = _job_queue.get()
+        try:
+            _run_job(get_db, job_id)
+        except Exception as e:
+            print(f"Error running allocation job {job_id}: {e}")
+        finally:
+            _job_queue.task_done()
+
+def _update_job(get_db, job_id, **values):
+    with get_db() as db:
+        db.query(AllocationJob).filter(AllocationJob.id == job_id).update(values, synchronize_session=False)
+        db.commit()
+
+def _run_job(get_db, job_id):
+    with get_db() as db:
+        job = db.query(AllocationJob).filter(AllocationJob.id == job_id).first()
+        warehouse_id, parallel, workers = job.warehouse_id, job.parallel, job.workers
+        if warehouse_id is not None:
+            warehouse_ids = [warehouse_id]
+        else:
+            warehouse_ids = [wid for (wid,) in db.query(Warehouse.id).order_by(Warehouse.id)]
+
+    _update_job(get_db, job_id, status="running", started_at=datetime.utcnow())
+    start = time.perf_counter()
+    progress = []
+
+    def report(entry):
+        progress.append(entry)
+        _update_job(get_db, job_id, progress=list(progress))
+
+    try:
+        if parallel and len(warehouse_ids) > 1:
+            warehouses_info = allocate_warehouses_parallel(warehouse_ids, workers, on_result=report)
+        else:
+            warehouses_info = [allocate_warehouse(wid, get_db, on_iteration=report) for wid in warehouse_ids]
+    except Exception as e:
+        _update_job(get_db, job_id, status="failed", error=str(e), finished_at=datetime.utcnow())
+        return
+
+    failed = [info["warehouse_id"] for info in warehouses_info if info["status"] != "completed"]
+    result = {
+        "warehouses": warehouses_info,
+        "orders_allocated": sum(info["orders_allocated"] for info in warehouses_info),
+        "elapsed_seconds": round(time.perf_counter() - start, 3),
+    }
+    _update_job(
+        get_db, job_id,
+        status="failed" if failed else "completed",
+        result=result,
+        error=f"Allocation failed for warehouses {failed}" if failed else None,
+        finished_at=datetime.utcnow(),
+    )
@@ -0,0 +1,149 @@
+import os
+import threading
+import numpy as np
+
+# dtype of the distance matrices used for clustering, float32 halves their memory
+DISTANCE_DTYPE = np.dtype(os.getenv("DISTANCE_DTYPE", "float32"))
+# Memory budget of one block when distances are computed a block of rows at a time
+DISTANCE_MEMORY_BUDGET = int(os.getenv("DISTANCE_MEMORY_BUDGET", 64 * 1024 * 1024))
+
+class ScratchBuffers:
+    def __init__(self):
+        """
+        Named buffers reused across calls, so the distance matrices of successive clusters
+        and iterations do not allocate fresh memory every time. A buffer only grows.
+        """
+        self._buffers = {}
+
+    def get(self, name, shape, dtype):
+        """
+        Array of the given shape backed by the named buffer. Its contents are undefined, and
+        it is overwritten by the next get with the same name and dtype.
+
+        Parameters:
+        name (str): Buffer name.
+        shape (tuple): Shape of the array.
+        dtype (np.dtype): dtype of the array.
+
+        Returns:
+        np.ndarray: Array of the given shape and dtype.
+        """
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape))
+        buffer = self._buffers.get((name, dtype))
+        if buffer is None or buffer.size < size:
+            buffer = np.empty(size, dtype=dtype)
+            self._buffers[(name, dtype)] = buffer
+        return buffer[:size].reshape(shape)
+
+    @property
+    def nbytes(self):
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+    def clear(self):
+        self._buffers.clear()
+
+_local = threading.local()
+
+def scratch_buffers():
+    """
+    Scratch buffers of the calling thread. Allocations running in different threads never
+    share a buffer.
+    """
+    scratch = getattr(_local, "scratch", None)
+    if scratch is None:
+        scratch = _local.scratch = ScratchBuffers()
+    return scratch
+
+def block_rows(n_columns, dtype=DISTANCE_DTYPE, budget=DISTANCE_MEMORY_BUDGET):
+    """
+    Number of rows of n_columns entries of dtype that fit in the memory budget, at least 1.
+    """
+    return max(1, budget // (np.dtype(dtype).itemsize * max(n_columns, 1)))
+
+def squared_distances(A, B, out=None, dtype=DISTANCE_DTYPE, center=None):
+    """
+    Squared Euclidean distances between every point of A and every point of B.
+
+    Computed as |a|^2 + |b|^2 - 2 a.b in place in the result, so no temporary of the
+    result's size is allocated. The points are shifted by `center` first, which keeps the
+    cancellation of that formula small in float32.
+
+    Parameters:
+    A (np.ndarray): Array of shape (n, 2).
+    B (np.ndarray): Array of shape (m, 2).
+    out (np.ndarray, optional): Array of shape (n, m) and dtype `dtype` receiving the result.
+    dtype (np.dtype): dtype of the computation and the result.
+    center (np.ndarray, optional): Shift applied to both sets, the mean of B when omitted.
+
+    Returns:
+    np.ndarray: Array of shape (n, m).
+    """
+    if center is None:
+        center = B.mean(axis=0) if len(B) else np.zeros(B.shape[1])
+    A = (A - center).astype(dtype, copy=False)
+    B = (B - center).astype(dtype, copy=False)
+    if out is None:
+        out = np.empty((A.shape[0], B.shape[0]), dtype=dtype)
+
+    np.matmul(A, B.T * dtype.type(-2), out=out)
+    out += np.einsum("ij,ij->i", A, A)[:, np.newaxis]
+    out += np.einsum("ij,ij->i", B, B)
+    return np.maximum(out, 0, out=out)
+
+def distances(A, B, out=None, dtype=DISTANCE_DTYPE):
+    """
+    Euclidean distances between every point of A and every point of B, see squared_distances.
+
+    Returns:
+    np.ndarray: Array of shape (n, m).
+    """
+    out = squared_distances(A, B, out, dtype)
+    return np.sqrt(out, out=out)
+
+class LazyDistances:
+    def __init__(self, A, B, dtype=DISTANCE_DTYPE):
+        """
+        Euclidean distances from every point of A to every point of B, computed on demand a
+        block at a time where the (n, m) matrix would not fit the memory budget.
+
+        Parameters:
+        A (np.ndarray): Array of shape (n, 2).
+        B (np.ndarray): Array of shape (m, 2).
+        dtype (np.dtype): dtype of the computation and the blocks.
+        """
+        self.A = A
+        self.B = B
+        self.dtype = np.dtype(dtype)
+        self.shape = (A.shape[0], B.shape[0])
+
+    def take(self, rows, columns, out):
+        """
+        Write the distances from A[rows] to B[columns] into out, of shape (len(rows), len(columns)).
+        """
+        return distances(self.A[rows], self.B[columns], out, self.dtype)
+
+def iter_squared_distance_blocks(A, B, dtype=DISTANCE_DTYPE, budget=DISTANCE_MEMORY_BUDGET, scratch=None):
+    """
+    Squared distances from A to B a block of rows at a time, each block within the memory budget.
+
+    Every block is written to the same scratch buffer, so a block must be used up before
+    the next one is requested.
+
+    Parameters:
+    A (np.ndarray): Array of shape (n, 2).
+    B (np.ndarray): Array of shape (m, 2).
+    dtype (np.dtype): dtype of the blocks.
+    budget (int): Memory budget of one block in bytes.
+    scratch (ScratchBuffers, optional): Buffers to reuse, the calling thread's when omitted.
+
+    Yields:
+    tuple: (start, stop, block) with block the squared distances of A[start:stop] to B.
+    """
+    scratch = scratch or scratch_buffers()
+    rows = block_rows(B.shape[0], dtype, budget)
+    center = B.mean(axis=0) if len(B) else np.zeros(B.shape[1])
+    for start in range(0, A.shape[0], rows):
+        stop = min(start + rows, A.shape[0])
+        block = scratch.get("distance_block", (stop - start, B.shape[0]), dtype)
+        yield start, stop, squared_distances(A[start:stop], B, block, dtype, center)
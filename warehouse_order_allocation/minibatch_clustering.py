@@ -0,0 +1,270 @@
+import os
+import numpy as np
+from .distances import DISTANCE_DTYPE, DISTANCE_MEMORY_BUDGET, block_rows, iter_squared_distance_blocks, squared_distances, scratch_buffers
+
+# Order sets larger than this are clustered with minibatch_constrained_kmeans, 0 disables it
+KMEANS_MINIBATCH_THRESHOLD = int(os.getenv("KMEANS_MINIBATCH_THRESHOLD", 100000))
+MINIBATCH_SIZE = 4096
+MINIBATCH_ITERS = 50
+MINIBATCH_BALANCED_ITERS = 3
+N_NEAREST_CENTROIDS = 8
+CELLS_PER_CENTROID = 8
+COARSE_GRID = 64
+
+def _nearest_centroids_brute(X, centroids, m, block_bytes):
+    n_samples, n_clusters = X.shape[0], centroids.shape[0]
+    indices = np.empty((n_samples, m), dtype=np.int64)
+    distances = np.empty((n_samples, m), dtype=DISTANCE_DTYPE)
+    columns = np.arange(n_clusters)
+
+    for start, stop, block in iter_squared_distance_blocks(X, centroids, budget=block_bytes):
+        indices[start:stop], distances[start:stop] = _closest_columns(block, columns, m)
+
+    return indices, np.sqrt(distances, out=distances)
+
+def _closest_columns(squared, columns, m):
+    # The m smallest entries of every row, sorted, with the matching entries of `columns`
+    if m < squared.shape[1]:
+        nearest = np.argpartition(squared, m - 1, axis=1)[:, :m]
+    else:
+        nearest = np.broadcast_to(np.arange(m), squared.shape)
+    nearest_distances = np.take_along_axis(squared, nearest, axis=1)
+    order = np.argsort(nearest_distances, axis=1)
+    nearest = np.take_along_axis(nearest, order, axis=1)
+    if columns.ndim == 1:
+        return columns[nearest], np.take_along_axis(nearest_distances, order, axis=1)
+    return np.take_along_axis(columns, nearest, axis=1), np.take_along_axis(nearest_distances, order, axis=1)
+
+def nearest_centroids(X, centroids, n_nearest, block_bytes=DISTANCE_MEMORY_BUDGET):
+    """
+    Find each point's nearest centroids, closest first, in bounded memory.
+
+    Points are bucketed in a grid with a few cells per centroid, and each occupied cell
+    gets the centroids nearest to its center as candidates. A cell's list is exact when its
+    last candidate is at least a cell diagonal farther than its n_nearest-th one; only the
+    points of the other cells are compared with every centroid, in blocks of block_bytes.
+
+    Parameters:
+    X (np.ndarray): Array of shape (n_samples, 2) with the points.
+    centroids (np.ndarray): Array of shape (n_clusters, 2) with the centroids.
+    n_nearest (int): Number of centroids kept per point.
+    block_bytes (int): Memory budget of one block of distances.
+
+    Returns:
+    np.ndarray: Array of shape (n_samples, m) with centroid indices, m = min(n_nearest, n_clusters).
+    np.ndarray: Array of shape (n_samples, m) with the matching distances.
+    """
+    n_samples, n_clusters = X.shape[0], centroids.shape[0]
+    m = min(n_nearest, n_clusters)
+    n_candidates = min(n_clusters, max(4 * m, 32))
+    if n_candidates == n_clusters or n_samples <= 4 * n_clusters:
+        return _nearest_centroids_brute(X, centroids, m, block_bytes)
+
+    # Size the cells by the area the points actually cover, so clustered orders get cells
+    # as fine as the centroids around them
+    origin = X.min(axis=0)
+    extent = np.maximum(X.max(axis=0) - origin, 1e-9)
+    coarse = np.minimum((X - origin) / extent * COARSE_GRID, COARSE_GRID - 1).astype(np.int64)
+    covered = np.count_nonzero(np.bincount(coarse[:, 0] * COARSE_GRID + coarse[:, 1], minlength=COARSE_GRID ** 2))
+    covered_area = extent[0] * extent[1] * covered / COARSE_GRID ** 2
+    n_cells = CELLS_PER_CENTROID * n_clusters
+    cell_size = max(np.sqrt(covered_area / n_cells), extent.max() / n_cells)
+
+    cells = np.minimum(X - origin, extent) // cell_size
+    n_rows = int(cells[:, 1].max()) + 1
+    occupied, point_cell = np.unique((cells[:, 0] * n_rows + cells[:, 1]).astype(np.int64), return_inverse=True)
+    point_cell = point_cell.reshape(-1)
+
+    # Candidates of every occupied cell, from its center. Every centroid among the n_nearest
+    # of a point in the cell is within the cell's n_nearest-th distance plus a diagonal.
+    centers = origin + (np.stack([occupied // n_rows, occupied % n_rows], axis=1) + 0.5) * cell_size
+    cell_candidates, cell_distances = _nearest_centroids_brute(centers, centroids, n_candidates, block_bytes)
+    exact_cell = cell_distances[:, -1] >= cell_distances[:, m - 1] + np.sqrt(2) * cell_size
+
+    # Gathering per-axis coordinates is much faster than gathering (x, y) pairs
+    candidate_x = centroids[cell_candidates, 0].astype(DISTANCE_DTYPE)
+    candidate_y = centroids[cell_candidates, 1].astype(DISTANCE_DTYPE)
+    point_x = X[:, 0].astype(DISTANCE_DTYPE)
+    point_y = X[:, 1].astype(DISTANCE_DTYPE)
+
+    indices = np.empty((n_samples, m), dtype=np.int64)
+    distances = np.empty((n_samples, m), dtype=DISTANCE_DTYPE)
+    exact = np.where(exact_cell[point_cell])[0]
+    block_size = block_rows(3 * n_candidates, DISTANCE_DTYPE, block_bytes)
+    for start in range(0, len(exact), block_size):
+        rows = exact[start:start + block_size]
+        row_cells = point_cell[rows]
+        squared = candidate_x[row_cells] - point_x[rows, np.newaxis]
+        squared *= squared
+        dy = candidate_y[row_cells] - point_y[rows, np.newaxis]
+        squared += dy * dy
+        nearest, nearest_distances = _closest_columns(squared, cell_candidates[row_cells], m)
+        indices[rows] = nearest
+        distances[rows] = np.sqrt(nearest_distances)
+
+    rest = np.where(~exact_cell[point_cell])[0]
+    if len(rest):
+        indices[rest], distances[rest] = _nearest_centroids_brute(X[rest], centroids, m, block_bytes)
+
+    return indices, distances
+
+def minibatch_kmeans(X, centroids, batch_size=MINIBATCH_SIZE, max_iters=MINIBATCH_ITERS):
+    """
+    Refine centroids with mini-batch k-means: every step moves each centroid towards the
+    mean of its points in a random batch, by the share of all its points seen so far.
+
+    Parameters:
+    X (np.ndarray): Array of shape (n_samples, 2) with the points.
+    centroids (np.ndarray): Initial centroids.
+    batch_size (int): Points drawn per step, raised to 4 per centroid for many centroids.
+    max_iters (int): Number of steps.
+
+    Returns:
+    np.ndarray: Refined centroids.
+    """
+    n_samples, n_clusters = X.shape[0], centroids.shape[0]
+    centroids = centroids.astype(float)
+    batch_size = min(n_samples, max(batch_size, 4 * n_clusters))
+    seen = np.zeros(n_clusters)
+
+    for _ in range(max_iters):
+        batch = X[np.random.randint(n_samples, size=batch_size)]
+        batch_distances = scratch_buffers().get("minibatch_distances", (batch_size, n_clusters), DISTANCE_DTYPE)
+        labels = np.argmin(squared_distances(batch, centroids, batch_distances), axis=1)
+
+        counts = np.bincount(labels, minlength=n_clusters)
+        hit = counts > 0
+        seen += counts
+        for dim in range(X.shape[1]):
+            sums = np.bincount(labels, weights=batch[:, dim], minlength=n_clusters)
+            centroids[hit, dim] += (sums[hit] - counts[hit] * centroids[hit, dim]) / seen[hit]
+
+    return centroids
+
+def sparse_balanced_assignment(candidates, candidate_distances, capacities):
+    """
+    Assign points to clusters without exceeding each cluster's capacity, considering only
+    each point's candidate clusters.
+
+    Same batched rounds as OrderAllocator.balanced_assignment: every point bids for its
+    nearest candidate with room and each cluster accepts the bids with the highest regret.
+    When a point has no second open candidate, the distance to its last candidate stands in
+    for the second choice, since every other cluster is at least that far.
+
+    Parameters:
+    candidates (np.ndarray): Array of shape (n_samples, m) with cluster indices, closest first.
+    candidate_distances (np.ndarray): Array of shape (n_samples, m) with the matching distances.
+    capacities (np.ndarray): Maximum number of points each cluster can take.
+
+    Returns:
+    np.ndarray: Cluster label for each point, -1 for points whose candidates are all full.
+    """
+    n_samples = candidates.shape[0]
+    labels = -1 * np.ones(n_samples, dtype=int)
+    remaining = np.array(capacities, dtype=int)
+    unassigned = np.arange(n_samples)
+
+    while len(unassigned) > 0:
+        open_candidates = remaining[candidates[unassigned]] > 0
+        can_bid = open_candidates.any(axis=1)
+        if not can_bid.any():
+            break
+        bidders = unassigned[can_bid]
+        open_candidates = open_candidates[can_bid]
+        rows = np.arange(len(bidders))
+
+        first = np.argmax(open_candidates, axis=1)
+        bids = candidates[bidders, first]
+        best_distance = candidate_distances[bidders, first]
+        open_candidates[rows, first] = False
+        second = np.argmax(open_candidates, axis=1)
+        second_distance = np.where(
+            open_candidates[rows, second], candidate_distances[bidders, second], candidate_distances[bidders, -1]
+        )
+        regret = second_distance - best_distance
+
+        # Rank the bids within each cluster, highest regret first and closest point on ties
+        order = np.lexsort((best_distance, -regret, bids))
+        sorted_bids = bids[order]
+        group_starts = np.searchsorted(sorted_bids, sorted_bids, side="left")
+        rank = np.arange(len(order)) - group_starts
+
+        accepted = order[rank < remaining[sorted_bids]]
+        labels[bidders[accepted]] = bids[accepted]
+        remaining -= np.bincount(bids[accepted], minlength=len(remaining))
+        unassigned = unassigned[labels[unassigned] == -1]
+
+    return labels
+
+def assign_with_capacities(X, centroids, capacities, n_nearest=N_NEAREST_CENTROIDS):
+    """
+    Balanced assignment of points to centroids with bounded memory.
+
+    Points are matched against their n_nearest open centroids; points whose candidates
+    fill up get new candidates among the centroids still open, until every point is placed
+    or every centroid is full.
+
+    Parameters:
+    X (np.ndarray): Array of shape (n_samples, 2) with the points.
+    centroids (np.ndarray): Array of shape (n_clusters, 2) with the centroids.
+    capacities (np.ndarray): Maximum number of points each cluster can take.
+    n_nearest (int): Candidate centroids per point.
+
+    Returns:
+    np.ndarray: Cluster label for each point, -1 once every cluster is full.
+    """
+    labels = -1 * np.ones(X.shape[0], dtype=int)
+    remaining = np.array(capacities, dtype=int)
+    unassigned = np.arange(X.shape[0])
+
+    while len(unassigned) > 0 and np.any(remaining > 0):
+        open_clusters = np.where(remaining > 0)[0]
+        candidates, candidate_distances = nearest_centroids(X[unassigned], centroids[open_clusters], n_nearest)
+        assigned = sparse_balanced_assignment(open_clusters[candidates], candidate_distances, remaining)
+
+        placed = assigned >= 0
+        labels[unassigned[placed]] = assigned[placed]
+        remaining -= np.bincount(assigned[placed], minlength=len(remaining))
+        unassigned = unassigned[~placed]
+
+    return labels
+
+def minibatch_constrained_kmeans(X, n_clusters, centroids, balanced_iters=MINIBATCH_BALANCED_ITERS):
+    """
+    Constrained k-means for large order sets: mini-batch k-means places the centroids, then
+    a few rounds of balanced assignment and re-centering give every cluster
+    n_samples // n_clusters points, with the leftover points spread one per cluster, as
+    OrderAllocator.constrained_kmeans does.
+
+    Time and memory grow linearly with the number of points instead of with
+    n_samples * n_clusters per iteration.
+
+    Parameters:
+    X (np.ndarray): Array of shape (n_samples, 2) with the points.
+    n_clusters (int): Number of clusters.
+    centroids (np.ndarray): Initial centroids, e.g. k-means++ seeds from a sample of X.
+    balanced_iters (int): Rounds of balanced assignment, at least 1.
+
+    Returns:
+    np.ndarray: Cluster labels for each point.
+    np.ndarray: Final centroids.
+    """
+    n_samples = X.shape[0]
+    centroids = minibatch_kmeans(X, centroids)
+
+    for _ in range(max(1, balanced_iters)):
+        labels = assign_with_capacities(X, centroids, np.full(n_clusters, n_samples // n_clusters, dtype=int))
+        unassigned_points = np.where(labels == -1)[0]
+        if len(unassigned_points) > 0:
+            labels[unassigned_points] = assign_with_capacities(
+                X[unassigned_points], centroids, np.ones(n_clusters, dtype=int)
+            )
+
+        # Move the centroids to the balanced clusters
+        cluster_counts = np.bincount(labels, minlength=n_clusters)
+        non_empty = cluster_counts > 0
+        for dim in range(X.shape[1]):
+            sums = np.bincount(labels, weights=X[:, dim], minlength=n_clusters)
+            centroids[non_empty, dim] = sums[non_empty] / cluster_counts[non_empty]
+
+    return labels, centroids
@@ -0,0 +1,199 @@
+import threading
+import numpy as np
+from sqlalchemy import update, insert
+from database.models import OrdersBigPic, Warehouse, AgentsBigPic, RouteStop
+from database.order_counters import bump_order_counters
+from database.data_version import bump_data_version
+from database.warehouse_lock import try_warehouse_allocation_lock
+
+MAX_ORDERS_PER_AGENT = 60
+MAX_DISTANCE_PER_AGENT = 100
+
+# agent id -> (route_version, stop coordinates in seq order)
+_route_cache = {}
+_route_cache_lock = threading.Lock()
+
+def load_routes(session, agents):
+    """
+    Get the stop coordinates of the given agents' routes, from the cache when the agent's
+    route_version still matches the cached route and from Route_stops otherwise.
+
+    Allocation, insertion and checkout all increase route_version when they change a route,
+    in every process, so a matching version identifies the same route.
+
+    Parameters:
+    session (Session): SQLAlchemy session.
+    agents (list): Rows with id and route_version.
+
+    Returns:
+    dict: Agent ID -> np.ndarray of shape (no_of_orders, 2) in stop order.
+    """
+    routes = {}
+    missing = []
+    with _route_cache_lock:
+        for agent in agents:
+            cached = _route_cache.get(agent.id)
+            if cached is not None and cached[0] == agent.route_version:
+                routes[agent.id] = cached[1]
+            else:
+                missing.append(agent)
+
+    if missing:
+        stops = {agent.id: [] for agent in missing}
+        rows = session.query(RouteStop.agent_id, OrdersBigPic.x_coord, OrdersBigPic.y_coord).join(
+            OrdersBigPic, OrdersBigPic.id == RouteStop.order_id
+        ).filter(RouteStop.agent_id.in_(list(stops))).order_by(RouteStop.agent_id, RouteStop.seq)
+        for agent_id, x_coord, y_coord in rows:
+            stops[agent_id].append((x_coord, y_coord))
+
+        with _route_cache_lock:
+            for agent in missing:
+                route = np.array(stops[agent.id], dtype=float).reshape(-1, 2)
+                routes[agent.id] = route
+                _route_cache[agent.id] = (agent.route_version, route)
+
+    return routes
+
+def cheapest_insertion(start, stops, point):
+    """
+    Find the position in an open route where visiting a new point adds the least distance.
+
+    Parameters:
+    start (tuple): Coordinates (x, y) the route starts from.
+    stops (np.ndarray): Array of shape (n, 2) with the route's stops in order.
+    point (tuple): Coordinates (x, y) of the new stop.
+
+    Returns:
+    tuple: (position, added distance), the new stop goes before stops[position], or last when position == n.
+    """
+    nodes = np.vstack([np.asarray(start, dtype=float)[np.newaxis, :], stops])
+    to_point = np.linalg.norm(nodes - np.asarray(point, dtype=float), axis=1)
+
+    # Inserting after node p replaces the leg p -> p + 1 by p -> point -> p + 1
+    added = to_point.copy()
+    if len(stops):
+        legs = np.linalg.norm(np.diff(nodes, axis=0), axis=1)
+        added[:-1] += to_point[1:] - legs
+
+    position = int(np.argmin(added))
+    return position, float(added[position])
+
+def insert_order_into_route(session, order_id, max_orders=MAX_ORDERS_PER_AGENT, max_distance=MAX_DISTANCE_PER_AGENT):
+    """
+    Assign one undelivered order to the checked-in agent of its warehouse whose route grows
+    the least by taking it, inserting the order at the cheapest position of that route.
+
+    Only the chosen agent's row and route stops are written. The warehouse's allocation lock
+    is taken without waiting: while an allocation of the warehouse runs, the order is left to
+    it, as it reloads the undelivered orders every iteration. The order is only claimed if it
+    is still undelivered once the lock is held.
+
+    Parameters:
+    session (Session): SQLAlchemy session.
+    order_id (int): ID of the order to assign.
+    max_orders (int): Maximum number of orders per agent.
+    max_distance (float): Maximum route length per agent.
+
+    Returns:
+    int: ID of the agent the order was assigned to, or None if no agent could take it.
+    """
+    try:
+        order = session.query(
+            OrdersBigPic.id, OrdersBigPic.warehouse_id, OrdersBigPic.x_coord, OrdersBigPic.y_coord, OrdersBigPic.is_delivered
+        ).filter(OrdersBigPic.id == order_id).first()
+        if order is None or order.is_delivered:
+            return None
+        with try_warehouse_allocation_lock(session, order.warehouse_id) as locked:
+            if not locked:
+                return None
+            # An allocation may have delivered the order before the lock was taken
+            if session.query(OrdersBigPic.is_delivered).filter(OrdersBigPic.id == order.id).scalar():
+                session.rollback()
+                return None
+            point = (order.x_coord, order.y_coord)
+
+            warehouse = session.query(Warehouse.x_coord, Warehouse.y_coord).filter(Warehouse.id == order.warehouse_id).first()
+            start = (warehouse.x_coord, warehouse.y_coord)
+
+            agents = session.query(
+                AgentsBigPic.id, AgentsBigPic.no_of_orders, AgentsBigPic.total_distance, AgentsBigPic.route_version
+            ).filter(
+                AgentsBigPic.warehouse_id == order.warehouse_id,
+                AgentsBigPic.is_checked_in == True,
+                AgentsBigPic.no_of_orders < max_orders,
+            ).all()
+            routes = load_routes(session, agents)
+
+            best = None
+            for agent in agents:
+                position, added = cheapest_insertion(start, routes[agent.id], point)
+                if agent.total_distance + added > max_distance:
+                    continue
+                if best is None or added < best[2]:
+                    best = (agent, position, added)
+            if best is None:
+                # Ends the transaction, and with it the database lock
+                session.rollback()
+                return None
+
+            agent, position, added = best
+            stops = routes[agent.id]
+            previous = stops[position - 1] if position > 0 else start
+            route_version = (agent.route_version or 0) + 1
+            values = {
+                "no_of_orders": agent.no_of_orders + 1,
+                "total_distance": agent.total_distance + added,
+                "route_version": route_version,
+            }
+            if position == len(stops):
+                values["last_x"], values["last_y"] = point
+
+            # Both updates only apply to the rows as they were read, anything changed since
+            # by another process rolls the insertion back
+            result = session.execute(
+                update(OrdersBigPic).where(OrdersBigPic.id == order.id, OrdersBigPic.is_delivered == False).values(
+                    is_delivered=True, assigned_agent_id=agent.id
+                )
+            )
+            if result.rowcount != 1:
+                session.rollback()
+                return None
+            result = session.execute(
+                update(AgentsBigPic).where(
+                    AgentsBigPic.id == agent.id, AgentsBigPic.route_version == agent.route_version
+                ).values(**values)
+            )
+            if result.rowcount != 1:
+                session.rollback()
+                return None
+
+            if position < len(stops):
+                # Make room at `position`; negating first keeps (agent_id, seq) unique at every step
+                session.execute(
+                    update(RouteStop).where(RouteStop.agent_id == agent.id, RouteStop.seq >= position).values(seq=-RouteStop.seq - 1)
+                )
+                session.execute(
+                    update(RouteStop).where(RouteStop.agent_id == agent.id, RouteStop.seq < 0).values(seq=-RouteStop.seq)
+                )
+                session.execute(
+                    update(RouteStop).where(RouteStop.agent_id == agent.id, RouteStop.seq == position + 1).values(
+                        leg_distance=float(np.hypot(stops[position][0] - point[0], stops[position][1] - point[1]))
+                    )
+                )
+            session.execute(insert(RouteStop.__table__), [{
+                "agent_id": agent.id,
+                "seq": position,
+                "order_id": order.id,
+                "leg_distance": float(np.hypot(point[0] - previous[0], point[1] - previous[1])),
+            }])
+            bump_order_counters(session, {order.warehouse_id: -1})
+            bump_data_version(session)
+            session.commit()
+
+            with _route_cache_lock:
+                _route_cache[agent.id] = (route_version, np.insert(stops, position, point, axis=0))
+            return agent.id
+    except Exception as e:
+        session.rollback()
+        print(f"Error inserting order {order_id} into a route: {e}")
+        return None
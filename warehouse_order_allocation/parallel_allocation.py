@@ -0,0 +1,81 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from database.db import get_db
+from database.models import Warehouse
+from monitoring.memory import track_peak_memory
+from monitoring.metrics import observe_allocation
+from .Order_allocator import OrderAllocator
+
+ALLOCATION_WORKERS = int(os.getenv("ALLOCATION_WORKERS", os.cpu_count() or 1))
+# The pool is started from server and job threads, and forking a threaded process can copy locks
+# held by other threads (connection pool, logging) into the workers. They start from a fresh
+# interpreter instead, which also means no database connection is inherited.
+POOL_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+def allocate_warehouse(warehouse_id, get_db=get_db, on_iteration=None):
+    """
+    Run the order allocation for one warehouse on its own database session and record its metrics.
+
+    Parameters:
+    warehouse_id (int): ID of the warehouse to allocate orders for.
+    get_db (function): Function to provide a database session.
+    on_iteration (function, optional): Progress callback passed on to OrderAllocator.
+
+    Returns:
+    dict: Summary with the warehouse ID, status, orders allocated, iterations, seconds per phase and
+    elapsed seconds, plus the peak memory in bytes when TRACE_MEMORY is set.
+    """
+    start = time.perf_counter()
+    summary = {"warehouse_id": warehouse_id, "status": "completed", "orders_allocated": 0}
+    try:
+        with get_db() as db:
+            warehouse = db.query(Warehouse).filter(Warehouse.id == warehouse_id).first()
+            if not warehouse:
+                summary["status"] = "not_found"
+            else:
+                allocator = OrderAllocator(db, warehouse, on_iteration)
+                with track_peak_memory() as memory:
+                    summary["orders_allocated"] = allocator.allocate_orders()
+                summary["iterations"] = allocator.iterations
+                summary["phase_seconds"] = {phase: round(seconds, 3) for phase, seconds in allocator.phase_seconds.items()}
+                if memory["peak_bytes"] is not None:
+                    summary["peak_memory_bytes"] = memory["peak_bytes"]
+    except Exception as e:
+        print(f"Error allocating orders for warehouse {warehouse_id}: {e}")
+        summary["status"] = "failed"
+        summary["error"] = str(e)
+
+    summary["elapsed_seconds"] = round(time.perf_counter() - start, 3)
+    observe_allocation(summary)
+    return summary
+
+def allocate_warehouses_parallel(warehouse_ids, max_workers=None, on_result=None):
+    """
+    Allocate orders for several warehouses concurrently, one process per warehouse.
+
+    Warehouses share no agents or orders, so each worker runs its own OrderAllocator
+    on a session of its own.
+
+    Parameters:
+    warehouse_ids (list): IDs of the warehouses to allocate orders for.
+    max_workers (int, optional): Size of the process pool, ALLOCATION_WORKERS when omitted.
+    on_result (function, optional): Called with each warehouse summary as soon as it finishes.
+
+    Returns:
+    list: Per-warehouse summaries as returned by allocate_warehouse, in the order of warehouse_ids.
+    """
+    max_workers = min(max_workers or ALLOCATION_WORKERS, len(warehouse_ids)) or 1
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=POOL_CONTEXT) as executor:
+        futures = {executor.submit(allocate_warehouse, warehouse_id): warehouse_id for warehouse_id in warehouse_ids}
+        results = {}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            # Metrics recorded in the worker process stay there, record them here as well
+            observe_allocation(results[futures[future]])
+            if on_result is not None:
+                on_result(results[futures[future]])
+    return [results[warehouse_id] for warehouse_id in warehouse_ids]
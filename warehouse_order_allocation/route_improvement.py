@@ -0,0 +1,137 @@
+import time
+import numpy as np
+
+def route_length(start, points):
+    """
+    Length of the open route from start through the given stops.
+
+    Parameters:
+    start (tuple): Coordinates (x, y) the route starts from.
+    points (np.ndarray): Array of shape (m, 2) with the stops in visiting order.
+
+    Returns:
+    float: Sum of the leg distances.
+    """
+    nodes = np.vstack([np.asarray(start, dtype=float)[np.newaxis, :], np.asarray(points, dtype=float).reshape(-1, 2)])
+    return float(np.linalg.norm(np.diff(nodes, axis=0), axis=1).sum())
+
+def two_opt_move(distance_matrix):
+    """
+    Find the best 2-opt move on an open path with a fixed start.
+
+    The path visits the nodes 0..m in index order. Reversing the segment i..j replaces the
+    legs (i-1, i) and (j, j+1) by (i-1, j) and (i, j+1); when j is the last node only the
+    first leg changes.
+
+    Parameters:
+    distance_matrix (np.ndarray): Distances between the path's nodes, in path order.
+
+    Returns:
+    tuple: (delta, i, j) of the best move, delta is >= 0 when no move shortens the path.
+    """
+    m = distance_matrix.shape[0] - 1
+    if m < 2:
+        return 0.0, 0, 0
+
+    i, j = np.triu_indices(m + 1, k=1)
+    keep = i >= 1
+    i, j = i[keep], j[keep]
+
+    delta = distance_matrix[i - 1, j] - distance_matrix[i - 1, i]
+    inner = j < m
+    delta[inner] += (
+        distance_matrix[i[inner], j[inner] + 1] - distance_matrix[j[inner], j[inner] + 1]
+    )
+
+    best = np.argmin(delta)
+    return float(delta[best]), int(i[best]), int(j[best])
+
+def or_opt_move(distance_matrix, max_segment=3):
+    """
+    Find the best Or-opt move on an open path with a fixed start.
+
+    A segment of up to max_segment consecutive nodes is cut out and reinserted, in the same
+    orientation, after another node of the path.
+
+    Parameters:
+    distance_matrix (np.ndarray): Distances between the path's nodes, in path order.
+    max_segment (int): Longest segment considered.
+
+    Returns:
+    tuple: (delta, start, length, after) of the best move, delta is >= 0 when no move shortens the path.
+    """
+    m = distance_matrix.shape[0] - 1
+    best = (0.0, 0, 0, 0)
+
+    for length in range(1, min(max_segment, m - 1) + 1):
+        starts = np.arange(1, m - length + 2)
+        ends = starts + length - 1
+
+        # Distance saved by cutting the segment out and closing the gap
+        removal_gain = distance_matrix[starts - 1, starts].copy()
+        inner = ends < m
+        removal_gain[inner] += (
+            distance_matrix[ends[inner], ends[inner] + 1] - distance_matrix[starts[inner] - 1, ends[inner] + 1]
+        )
+
+        # Cost of inserting it between node k and k + 1, or after the last node
+        k = np.arange(m + 1)
+        after = distance_matrix[np.ix_(k, starts)]
+        before_next = np.zeros_like(after)
+        has_next = k < m
+        before_next[has_next] = (
+            distance_matrix[np.ix_(ends, k[has_next] + 1)].T - distance_matrix[k[has_next], k[has_next] + 1][:, np.newaxis]
+        )
+        insertion_cost = after + before_next
+
+        delta = insertion_cost - removal_gain[np.newaxis, :]
+
+        # Insertion points inside or directly around the segment are not moves
+        invalid = (k[:, np.newaxis] >= starts - 1) & (k[:, np.newaxis] <= ends)
+        delta[invalid] = np.inf
+
+        flat = np.argmin(delta)
+        k_best, s_best = np.unravel_index(flat, delta.shape)
+        if delta[k_best, s_best] < best[0]:
+            best = (float(delta[k_best, s_best]), int(starts[s_best]), length, int(k_best))
+
+    return best
+
+def improve_route(start, points, deadline, max_segment=3, tol=1e-9):
+    """
+    Shorten an open route from a fixed start with 2-opt and Or-opt moves until no move
+    helps or the deadline passes.
+
+    Parameters:
+    start (tuple): Coordinates (x, y) the route starts from.
+    points (np.ndarray): Array of shape (m, 2) with the stops in their current order.
+    deadline (float): time.perf_counter() value after which no further moves are tried.
+    max_segment (int): Longest segment considered by Or-opt.
+    tol (float): Minimum improvement for a move to be applied.
+
+    Returns:
+    np.ndarray: Permutation of range(m) giving the improved visiting order.
+    """
+    nodes = np.vstack([np.asarray(start, dtype=float)[np.newaxis, :], np.asarray(points, dtype=float)])
+    full_matrix = np.linalg.norm(nodes[:, np.newaxis, :] - nodes[np.newaxis, :, :], axis=2)
+    order = np.arange(len(nodes))
+
+    while time.perf_counter() < deadline:
+        distance_matrix = full_matrix[np.ix_(order, order)]
+
+        delta, i, j = two_opt_move(distance_matrix)
+        if delta < -tol:
+            order[i:j + 1] = order[i:j + 1][::-1]
+            continue
+
+        delta, seg_start, length, after = or_opt_move(distance_matrix, max_segment)
+        if delta < -tol:
+            segment = order[seg_start:seg_start + length]
+            rest = np.concatenate([order[:seg_start], order[seg_start + length:]])
+            insert_at = after + 1 if after < seg_start else after + 1 - length
+            order = np.concatenate([rest[:insert_at], segment, rest[insert_at:]])
+            continue
+
+        break
+
+    return order[1:] - 1
@@ -0,0 +1,155 @@
+import math
+import numpy as np
+
+class SpatialGrid:
+    def __init__(self, points, labels=None, cell_size=None, points_per_cell=2):
+        """
+        Uniform grid over a set of points for nearest-neighbour queries with removal.
+
+        Points are bucketed by (label, cell) so that one grid built over all orders of an
+        allocation iteration can be shared by every cluster; queries only look at points
+        carrying the requested label.
+
+        Parameters:
+        points (np.ndarray): Array of shape (n_points, 2) with x and y coordinates.
+        labels (np.ndarray, optional): Cluster label of each point, all 0 when omitted.
+        cell_size (float, optional): Side of a grid cell, derived from the point density when omitted.
+        points_per_cell (int): Average number of points per cell used to derive the cell size.
+        """
+        self.points = np.asarray(points, dtype=float)
+        n_points = self.points.shape[0]
+        if labels is None:
+            labels = np.zeros(n_points, dtype=int)
+        self.labels = np.asarray(labels, dtype=int)
+
+        if n_points:
+            self.origin = self.points.min(axis=0)
+            extent = self.points.max(axis=0) - self.origin
+        else:
+            self.origin = np.zeros(2)
+            extent = np.zeros(2)
+
+        if cell_size is None:
+            # The second term keeps cells sensible when the points lie on a line
+            n_cells = max(n_points, 1) / points_per_cell
+            cell_size = max(math.sqrt(extent[0] * extent[1] / n_cells), extent.max() / n_cells)
+        self.cell_size = max(float(cell_size), 1e-9)
+
+        self.active = np.ones(n_points, dtype=bool)
+        self.cells = {}  # (label, cx, cy) -> list of point indices
+        self.bounds = {}  # label -> [min cx, min cy, max cx, max cy]
+        self.counts = {}  # label -> number of active points
+
+        cell_coords = np.floor((self.points - self.origin) / self.cell_size).astype(int)
+        for idx, (label, (cx, cy)) in enumerate(zip(self.labels.tolist(), cell_coords.tolist())):
+            self.cells.setdefault((label, cx, cy), []).append(idx)
+            self.counts[label] = self.counts.get(label, 0) + 1
+            bounds = self.bounds.get(label)
+            if bounds is None:
+                self.bounds[label] = [cx, cy, cx, cy]
+            else:
+                bounds[0] = min(bounds[0], cx)
+                bounds[1] = min(bounds[1], cy)
+                bounds[2] = max(bounds[2], cx)
+                bounds[3] = max(bounds[3], cy)
+
+    def count(self, label=0):
+        """
+        Number of points with the given label still in the index.
+        """
+        return self.counts.get(int(label), 0)
+
+    def remove(self, idx):
+        """
+        Remove a point from the index so later queries skip it.
+
+        Parameters:
+        idx (int): Index of the point in the array the grid was built from.
+
+        Returns:
+        None
+        """
+        idx = int(idx)
+        if not self.active[idx]:
+            return
+        self.active[idx] = False
+        label = int(self.labels[idx])
+        key = (label,) + self._cell_of(self.points[idx])
+        bucket = self.cells[key]
+        bucket.remove(idx)
+        if not bucket:
+            del self.cells[key]
+        self.counts[label] -= 1
+
+    def nearest(self, location, label=0):
+        """
+        Find the closest point with the given label that is still in the index.
+
+        The search walks square rings of cells outwards from the query cell and stops as
+        soon as no unvisited ring can hold a closer point.
+
+        Parameters:
+        location (tuple): Query coordinates (x, y).
+        label (int): Cluster label to search in.
+
+        Returns:
+        tuple: (index, distance) of the closest point, or (None, inf) when the label has no points left.
+        """
+        label = int(label)
+        if self.count(label) == 0:
+            return None, math.inf
+
+        qx, qy = float(location[0]), float(location[1])
+        qcx, qcy = self._cell_of((qx, qy))
+        min_cx, min_cy, max_cx, max_cy = self.bounds[label]
+
+        # Rings closer than the label's bounding box are empty, and rings past it cannot exist
+        start_ring = max(min_cx - qcx, qcx - max_cx, min_cy - qcy, qcy - max_cy, 0)
+        last_ring = max(abs(qcx - min_cx), abs(qcx - max_cx), abs(qcy - min_cy), abs(qcy - max_cy))
+
+        best_idx = None
+        best_distance = math.inf
+        points = self.points
+        for ring in range(start_ring, last_ring + 1):
+            for cx, cy in self._ring_cells(qcx, qcy, ring, min_cx, min_cy, max_cx, max_cy):
+                bucket = self.cells.get((label, cx, cy))
+                if not bucket:
+                    continue
+                for idx in bucket:
+                    distance = math.hypot(points[idx, 0] - qx, points[idx, 1] - qy)
+                    if distance < best_distance:
+                        best_idx, best_distance = idx, distance
+
+            # Every cell outside this ring is at least ring * cell_size away
+            if best_idx is not None and best_distance <= ring * self.cell_size:
+                break
+
+        return best_idx, best_distance
+
+    def _cell_of(self, location):
+        return (
+            int(math.floor((location[0] - self.origin[0]) / self.cell_size)),
+            int(math.floor((location[1] - self.origin[1]) / self.cell_size)),
+        )
+
+    @staticmethod
+    def _ring_cells(qcx, qcy, ring, min_cx, min_cy, max_cx, max_cy):
+        """
+        Yield the cells at Chebyshev distance `ring` from (qcx, qcy), clipped to the given bounds.
+        """
+        if ring == 0:
+            if min_cx <= qcx <= max_cx and min_cy <= qcy <= max_cy:
+                yield qcx, qcy
+            return
+
+        x_lo, x_hi = max(qcx - ring, min_cx), min(qcx + ring, max_cx)
+        for cy in (qcy - ring, qcy + ring):
+            if min_cy <= cy <= max_cy:
+                for cx in range(x_lo, x_hi + 1):
+                    yield cx, cy
+
+        y_lo, y_hi = max(qcy - ring + 1, min_cy), min(qcy + ring - 1, max_cy)
+        for cx in (qcx - ring, qcx + ring):
+            if min_cx <= cx <= max_cx:
+                for cy in range(y_lo, y_hi + 1):
+                    yield cx, cy